@@ -0,0 +1,301 @@
+import re
+import json
+import colorsys
+from pathlib import Path
+import metadata_files
+import metadata_store
+
+
+# Finds assets by their tags, categories, environment, color and components, for Quixel metadata (asset_metadata.json or .db) and the Fab metadata shipped in this repository. Not meant to be run on its own.
+# The first query builds an index of every asset and saves it next to the metadata (asset_index.json, fab_asset_index.json), so later queries only load the index. It's rebuilt whenever the metadata changes.
+# Queries look like: category=3d AND tag=rock AND has=displacement
+# They can use AND, OR, NOT and parentheses, and values are case-insensitive. Put values with spaces in quotes, like biome="temperate-forest". Run query_assets.py to try them out.
+# Quixel fields: type, category, tag, region, biome, environment (region or biome), color, has (component types like albedo or displacement), id
+# Fab fields: type (3d-model, material, environment), category, tag, format (fbx, unreal-engine, ...), id
+
+
+index_version = 1 # Indexes saved with another version are rebuilt
+fab_names = ["fab_asset_metadata.json", "fab_asset_metadata.json.zst", "fab_asset_metadata.tar.zst"] # Looked for in this order, in the given folder and then next to this script
+quixel_fields = ["name",
+                 "full_metadata.semanticTags.asset_type",
+                 "full_metadata.categories",
+                 "full_metadata.tags",
+                 "full_metadata.environment",
+                 "full_metadata.averageColor",
+                 "full_metadata.components",
+                 "full_metadata.maps"]
+
+
+TOKEN_PATTERN = re.compile(r"""\s*(\(|\)|[\w.-]+\s*=\s*(?:"[^"]*"|'[^']*'|[^\s()]+)|[^\s()]+)""")
+
+
+def color_name(hex_color):
+    # Sorts an average color like "#6F5E4E" into one of a few named colors, which are easier to search for than exact values
+    try:
+        red, green, blue = (int(hex_color.lstrip("#")[position:position + 2], 16) / 255 for position in (0, 2, 4))
+    except (ValueError, AttributeError):
+        return None
+
+    hue, lightness, saturation = colorsys.rgb_to_hls(red, green, blue)
+    hue *= 360
+
+    if lightness < 0.12:
+        return "black"
+    elif lightness > 0.88:
+        return "white"
+    elif saturation < 0.12:
+        return "gray"
+    elif 15 <= hue < 50 and lightness < 0.5:
+        return "brown"
+
+    for limit, name in [(15, "red"), (45, "orange"), (70, "yellow"), (165, "green"), (200, "cyan"), (260, "blue"), (330, "purple"), (360, "red")]:
+        if hue < limit:
+            return name
+
+
+def quixel_terms(asset):
+    # Returns [(field, value), ...] for an asset from asset_metadata.json
+    full_metadata = asset.get("full_metadata", {})
+    environment = full_metadata.get("environment") or {}
+    terms = [("type", metadata_store.get_asset_type(asset))]
+
+    terms += [("category", category) for category in full_metadata.get("categories", [])]
+    terms += [("tag", tag) for tag in full_metadata.get("tags", [])]
+    terms += [("region", environment.get("region")), ("biome", environment.get("biome"))]
+    terms += [("environment", value) for value in environment.values() if isinstance(value, str)]
+    terms += [("color", color_name(full_metadata.get("averageColor")))]
+    terms += [("has", component["type"]) for component in full_metadata.get("components", []) + full_metadata.get("maps", []) if "type" in component]
+
+    return terms
+
+
+def fab_terms(asset):
+    # Returns [(field, value), ...] for an asset from fab_asset_metadata.json
+    category_path = (asset.get("category") or {}).get("path") or ""
+    terms = [("type", asset.get("listingType"))]
+
+    terms += [("category", category) for category in category_path.split("/")] + [("category", category_path)]
+    terms += [("tag", tag.get("slug")) for tag in asset.get("tags") or []]
+    terms += [("format", asset_format["assetFormatType"]["code"]) for asset_format in asset.get("assetFormats") or [] if asset_format.get("assetFormatType")]
+
+    return terms
+
+
+def get_source_key(source_path):
+    stat = source_path.stat()
+
+    return [source_path.name, stat.st_size, stat.st_mtime_ns]
+
+
+def find_fab_metadata(folder):
+    for search_folder in [folder, Path(__file__).parent]:
+        for name in fab_names:
+            if (search_folder / name).exists():
+                return search_folder / name
+
+    return None
+
+
+def iter_fab_assets(metadata_path):
+    with metadata_files.open_read(metadata_path) as f:
+        yield from json.load(f).items() # Small enough to just load
+
+
+class AssetIndex:
+    def __init__(self, ids, names, postings):
+        self.ids = ids
+        self.names = names
+        self.postings = postings # {field: {value: [positions of assets in ids]}}
+        self.bitmaps = {} # Posting lists turned into ints with one bit per asset, made when first queried
+        self.everything = (1 << len(ids)) - 1
+
+    @classmethod
+    def build(cls, assets, get_terms, get_name):
+        ids = []
+        names = []
+        postings = {}
+
+        for position, (asset_id, asset) in enumerate(assets):
+            ids.append(asset_id)
+            names.append(get_name(asset))
+
+            for field, value in get_terms(asset) + [("id", asset_id)]:
+                if isinstance(value, str) and value:
+                    positions = postings.setdefault(field, {}).setdefault(value.lower(), [])
+
+                    if not positions or positions[-1] != position: # Some terms show up twice for the same asset
+                        positions.append(position)
+
+        return cls(ids, names, postings)
+
+    def bitmap(self, field, value):
+        key = (field, value)
+
+        if key not in self.bitmaps:
+            if field not in self.postings:
+                raise ValueError(f"Unknown field {field!r}, should be one of {", ".join(sorted(self.postings))}")
+
+            bits = bytearray((len(self.ids) + 7) // 8)
+            for position in self.postings[field].get(value, []):
+                bits[position >> 3] |= 1 << (position & 7)
+
+            self.bitmaps[key] = int.from_bytes(bits, "little")
+
+        return self.bitmaps[key]
+
+    def query(self, text):
+        # Returns the IDs of every matching asset, in metadata order
+        bits = Query(text, self).parse()
+        matches = []
+
+        for byte_position, byte in enumerate(bits.to_bytes((len(self.ids) + 7) // 8, "little")):
+            if byte: # Most bytes are empty for narrow queries
+                matches += [self.ids[byte_position * 8 + bit] for bit in range(8) if byte >> bit & 1]
+
+        return matches
+
+    def values(self, field):
+        # Returns {value: number of assets} for a field, most common first
+        return dict(sorted(((value, len(positions)) for value, positions in self.postings.get(field, {}).items()), key=lambda item: -item[1]))
+
+    def save(self, index_path, source_key):
+        temp_path = index_path.with_name(index_path.name + ".tmp")
+
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": index_version, "source": source_key, "ids": self.ids, "names": self.names, "postings": self.postings}, f, ensure_ascii=False, separators=(",", ":"))
+
+        temp_path.replace(index_path)
+
+
+class Query:
+    # Parses and evaluates a query in one go, with AND binding tighter than OR
+
+    def __init__(self, text, index):
+        self.tokens = TOKEN_PATTERN.findall(text)
+        self.position = 0
+        self.index = index
+
+        if "".join(self.tokens).replace(" ", "") != re.sub(r"\s", "", text):
+            raise ValueError(f"Couldn't understand the query {text!r}")
+
+    def peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else None
+
+    def take(self):
+        token = self.peek()
+        self.position += 1
+
+        return token
+
+    def parse(self):
+        if not self.tokens:
+            raise ValueError("The query is empty")
+
+        bits = self.parse_or()
+
+        if self.peek() is not None:
+            raise ValueError(f"Unexpected {self.peek()!r} in the query")
+
+        return bits
+
+    def parse_or(self):
+        bits = self.parse_and()
+
+        while self.peek() is not None and self.peek().upper() == "OR":
+            self.take()
+            bits |= self.parse_and()
+
+        return bits
+
+    def parse_and(self):
+        bits = self.parse_not()
+
+        while self.peek() is not None and self.peek() != ")" and self.peek().upper() != "OR":
+            if self.peek().upper() == "AND":
+                self.take()
+            bits &= self.parse_not()
+
+        return bits
+
+    def parse_not(self):
+        token = self.take()
+
+        if token is None:
+            raise ValueError("The query ends too early")
+        elif token.upper() == "NOT":
+            return self.index.everything & ~self.parse_not()
+        elif token == "(":
+            bits = self.parse_or()
+
+            if self.take() != ")":
+                raise ValueError("Missing ) in the query")
+
+            return bits
+        elif "=" in token:
+            field, value = (part.strip() for part in token.split("=", 1))
+
+            return self.index.bitmap(field.lower(), value.strip("\"'").lower())
+        else:
+            raise ValueError(f"Expected field=value in the query, got {token!r}")
+
+
+def load_cached(index_path, source_key):
+    try:
+        with open(index_path, "r", encoding="utf-8") as f:
+            cached = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+    if cached.get("version") != index_version or cached.get("source") != source_key:
+        return None
+
+    return AssetIndex(cached["ids"], cached["names"], cached["postings"])
+
+
+def load_quixel_index(folder):
+    # Raises FileNotFoundError if there's no asset metadata in folder
+    source_path = folder / "asset_metadata.db" if (folder / "asset_metadata.db").exists() else metadata_files.find_metadata(folder)
+
+    if source_path is None:
+        raise FileNotFoundError(folder / "asset_metadata.json")
+
+    source_key = get_source_key(source_path)
+    index = load_cached(folder / "asset_index.json", source_key)
+
+    if index is None:
+        print(f"\nIndexing {source_path.name}... (only needed once, or after it changes)")
+        asset_metadata = metadata_store.open_metadata(folder, fields=quixel_fields)
+        index = AssetIndex.build(asset_metadata.items(), quixel_terms, lambda asset: asset.get("name"))
+        asset_metadata.close()
+        index.save(folder / "asset_index.json", source_key)
+
+    return index
+
+
+def load_fab_index(folder):
+    # Raises FileNotFoundError if there's no Fab metadata in folder or next to this script
+    source_path = find_fab_metadata(folder)
+
+    if source_path is None:
+        raise FileNotFoundError(folder / "fab_asset_metadata.json")
+
+    source_key = get_source_key(source_path)
+    index = load_cached(folder / "fab_asset_index.json", source_key)
+
+    if index is None:
+        print(f"\nIndexing {source_path.name}...")
+        index = AssetIndex.build(iter_fab_assets(source_path), fab_terms, lambda asset: asset.get("title"))
+        index.save(folder / "fab_asset_index.json", source_key)
+
+    return index
+
+
+def get_query(argv):
+    # Returns the query given with --query "..." or --query="...", or None
+    for position, argument in enumerate(argv):
+        if argument == "--query" and position + 1 < len(argv):
+            return argv[position + 1]
+        elif argument.startswith("--query="):
+            return argument.removeprefix("--query=")
+
+    return None
@@ -0,0 +1,131 @@
+import os
+import json
+import math
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from tqdm import tqdm
+import quixel_client
+import quixel_metrics
+
+
+# Fetches the full asset listing from https://quixel.com/v1/assets page by page, and the complete metadata of single assets. Not meant to be run on its own.
+# Pages are fetched in parallel and saved to a pages file as they arrive, so an interrupted listing only fetches the missing pages when restarted.
+
+
+page_size = 200 # Max limit is 200
+
+
+def query_quixel_page(limit, page, rate_limiter):
+    backoff = quixel_client.Backoff("assets")
+
+    while True:
+        params = {"limit": limit,
+                  "page": page}
+
+        response = quixel_client.get("https://quixel.com/v1/assets", "assets", rate_limiter, params=params)
+
+        if response.status_code != 200:
+            print(f"\nEncountered error with page {page}! (Recieved status code {response.status_code} from Quixel server)")
+            backoff.wait(response)
+        else:
+            return response.json()
+
+
+def query_quixel_asset(asset, rate_limiter):
+    # Returns the complete metadata of one asset, used by get_all_complete_asset_metadata.py and sync_asset_metadata.py
+    backoff = quixel_client.Backoff("asset")
+
+    while True:
+        response = quixel_client.get(f"https://quixel.com/v1/assets/{asset}", "asset", rate_limiter)
+
+        if response.status_code != 200:
+            print(f"\nEncountered error with asset {asset}! (Recieved status code {response.status_code} from Quixel server)")
+            backoff.wait(response)
+        else:
+            try:
+                json_response = response.json()
+
+                return json_response
+            except json.JSONDecodeError:
+                print(f"Error on decode! Here is the response: {response}")
+                backoff.wait(response)
+
+
+def load_saved_pages(pages_path, total_assets):
+    # Returns {page: [asset, ...]} for every page saved by a previous run with the same total, or nothing if the total has changed since (pages would no longer line up)
+    saved_pages = {}
+
+    try:
+        with open(pages_path, "r", encoding="utf-8") as f:
+            lines = f.readlines()
+    except FileNotFoundError:
+        return saved_pages
+
+    try:
+        saved_total = json.loads(lines[0]).get("total") if lines else None
+    except json.JSONDecodeError:
+        saved_total = None
+
+    if saved_total != total_assets:
+        pages_path.unlink()
+        return saved_pages
+
+    for line in lines[1:]:
+        if not line.endswith("\n"): # Cut off by a crash mid-write, the page will just be fetched again
+            break
+
+        saved_page = json.loads(line)
+        saved_pages[saved_page["page"]] = saved_page["assets"]
+
+    return saved_pages
+
+
+def save_page(f, page, assets):
+    f.write(json.dumps({"page": page, "assets": assets}, ensure_ascii=False) + "\n")
+    f.flush()
+    os.fsync(f.fileno())
+
+
+def fetch_listing(pages_path, page_workers, rate_limiter):
+    # Returns the basic stats (total, facets, ...) and every listed asset in page order. Remove the pages file once the results are safely saved.
+    header = query_quixel_page(1, 1, rate_limiter)
+
+    del header["assets"]
+    del header["page"]
+    del header["pages"]
+    del header["count"]
+
+    total_assets = header["total"]
+    pages = math.ceil(total_assets / page_size) + 1 # Pages start from 1
+
+    saved_pages = load_saved_pages(pages_path, total_assets)
+    pages_to_fetch = [page for page in range(1, pages) if page not in saved_pages]
+
+    print(f"{total_assets} total assets detected.")
+    print(f"Downloading the asset listing from {pages - 1} pages with {page_size} items each. {len(saved_pages)} pages were already downloaded.")
+    print(f"Pages are fetched up to {page_workers} at a time, starting at {rate_limiter.rate} requests per second and adjusting to what the Quixel servers can handle, so please be patient!\n")
+
+    with open(pages_path, "a", encoding="utf-8") as f:
+        if f.tell() == 0: # New file, start it with the total the pages belong to
+            f.write(json.dumps({"total": total_assets}) + "\n")
+
+        executor = ThreadPoolExecutor(max_workers=page_workers)
+        futures = {executor.submit(query_quixel_page, page_size, page, rate_limiter): page for page in pages_to_fetch}
+
+        try:
+            # Pages arrive in any order, only this thread saves them
+            for finished, future in enumerate(tqdm(as_completed(futures), total=len(futures)), start=1):
+                quixel_metrics.set_gauge("quixel_queue_depth", len(futures) - finished, queue="pages")
+                page = futures[future]
+                assets = future.result()["assets"]
+
+                save_page(f, page, assets)
+                saved_pages[page] = assets
+        except KeyboardInterrupt:
+            # The pages saved so far are kept, the rest are dropped instead of waited for and fetched next time
+            quixel_client.stop_event.set()
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+
+        executor.shutdown()
+
+    return header, [asset for page in sorted(saved_pages) for asset in saved_pages[page]]
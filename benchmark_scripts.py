@@ -0,0 +1,186 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+from pathlib import Path
+import metadata_files
+import mock_quixel_server
+
+
+# Measures the scripts end to end against mock_quixel_server.py instead of quixel.com, so performance changes can be compared run to run.
+# Every script runs unmodified in its own process, with QUIXEL_MOCK_SERVER pointing quixel_client at the mock server.
+# Assets are seeded from the shipped basic_asset_metadata.tar.zst (read without extracting it), so runs use real asset IDs and names and are repeatable.
+# Run python benchmark_scripts.py --help for options.
+
+
+script_path = Path(__file__).parent
+seed_path = script_path / "basic_asset_metadata.tar.zst"
+
+
+def read_seed_metadata():
+    with metadata_files.open_read(seed_path) as f:
+        return json.load(f)
+
+
+def write_complete_metadata(assets, folder):
+    asset_metadata = {"total": len(assets), "asset_metadata": {}}
+
+    for index, (asset_id, name) in enumerate(assets):
+        asset_metadata["asset_metadata"][asset_id] = {"name": name, "full_metadata": mock_quixel_server.make_full_metadata(asset_id, name, index)}
+
+    with open(folder / "asset_metadata.json", "w", encoding="utf-8") as f:
+        json.dump(asset_metadata, f, ensure_ascii=False, indent=4)
+
+
+def run_script(name, folder, stdin_text, mock, base_url, bytes_read=None):
+    # Runs one script to completion and returns its measurements
+    mock.reset_stats()
+    environment = os.environ | {"QUIXEL_MOCK_SERVER": base_url, "QUIXEL_REFRESH_URL": f"{base_url}/v1/auth/refresh"}
+
+    with open(folder / "script_output.txt", "w", encoding="utf-8") as output:
+        start = time.monotonic()
+        process = subprocess.Popen([sys.executable, str(script_path / name)], cwd=folder, env=environment, stdin=subprocess.PIPE, stdout=output, stderr=subprocess.STDOUT, text=True)
+        process.stdin.write(stdin_text)
+        process.stdin.close()
+
+        if hasattr(os, "wait4"): # Gives the peak RSS of just this process
+            pid, status, usage = os.wait4(process.pid, 0)
+            process.returncode = os.waitstatus_to_exitcode(status)
+            peak_rss = usage.ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+        else:
+            process.wait()
+            peak_rss = None
+
+        elapsed = time.monotonic() - start
+
+    stats = mock.stats()
+    transferred = stats["bytes_sent"] if bytes_read is None else bytes_read(folder)
+
+    return {"script": name,
+            "exit_code": process.returncode,
+            "seconds": round(elapsed, 2),
+            "requests": stats["requests"],
+            "errors": stats["errors"],
+            "connections": stats["connections"],
+            "requests_per_second": round(stats["requests"] / elapsed, 2),
+            "megabytes": round(transferred / (1024*1024), 2),
+            "megabytes_per_second": round(transferred / (1024*1024) / elapsed, 2),
+            "peak_rss_megabytes": round(peak_rss / (1024*1024), 1) if peak_rss is not None else None}
+
+
+def zip_bytes(folder):
+    return sum(zip_file.stat().st_size for zip_file in folder.glob("*.zip"))
+
+
+def run_benchmarks(args):
+    seed = read_seed_metadata()
+    seeded_assets = list((asset_id, asset["name"]) for asset_id, asset in seed["asset_metadata"].items())
+
+    mock = mock_quixel_server.MockQuixel(seeded_assets[:args.crawl_assets], args.latency, args.error_rate, int(args.payload_size * 1024 * 1024), int(args.image_size * 1024), args.token_lifetime, args.packaging_time, args.download_id_lifetime)
+    server, base_url = mock_quixel_server.start_server(mock)
+    work_path = Path(args.work_dir) if args.work_dir else Path(tempfile.mkdtemp(prefix="quixel_benchmark_"))
+    results = []
+
+    print(f"Mock server at {base_url}, working in {work_path}")
+
+    def folder(name):
+        path = work_path / name
+        shutil.rmtree(path, ignore_errors=True)
+        path.mkdir(parents=True)
+
+        return path
+
+    try:
+        if "basic" in args.scenarios:
+            print("Running get_all_basic_asset_metadata.py...")
+            basic_path = folder("basic")
+            results.append(run_script("get_all_basic_asset_metadata.py", basic_path, "", mock, base_url))
+
+        if "complete" in args.scenarios:
+            print("Running get_all_complete_asset_metadata.py...")
+            complete_path = folder("complete")
+            with open(complete_path / "asset_metadata.json", "w", encoding="utf-8") as f:
+                json.dump({"total": len(mock.assets), "asset_metadata": {asset_id: {"name": name} for asset_id, name in mock.assets}}, f, ensure_ascii=False, indent=4)
+            results.append(run_script("get_all_complete_asset_metadata.py", complete_path, "", mock, base_url))
+
+        if "sync" in args.scenarios:
+            # Starts from up to date complete metadata, then revises some of the assets on the server
+            sync_path = folder("sync")
+            write_complete_metadata(mock.assets, sync_path)
+            revised_assets = [asset_id for asset_id, name in mock.assets[::10]]
+            mock.revise(revised_assets)
+
+            print(f"Running sync_asset_metadata.py with {len(revised_assets)} revised assets...")
+            results.append(run_script("sync_asset_metadata.py", sync_path, "", mock, base_url))
+
+            with metadata_files.open_read(metadata_files.find_metadata(sync_path)) as f:
+                synced = json.load(f)["asset_metadata"]
+            updated = sum(synced[asset_id]["full_metadata"]["revised"] == mock.revisions[asset_id] for asset_id in revised_assets)
+            print(f"{updated} of {len(revised_assets)} revised assets were updated.")
+            mock.revisions.clear()
+
+        if "download" in args.scenarios or "checksums" in args.scenarios:
+            # Every asset_types[0] asset among the first download_assets * len(asset_types) assets gets downloaded
+            assets_path = folder("assets")
+            write_complete_metadata(seeded_assets[:args.download_assets * len(mock_quixel_server.asset_types)], assets_path)
+
+            print("Running download_all_assets.py...")
+            token = json.dumps({"token": mock.issue_token(), "refreshToken": mock.refresh_token}) if args.token_lifetime else "mock-token" # Copied from Chrome, so it includes the refresh token
+            result = run_script("download_all_assets.py", assets_path, f"{assets_path}\n{token}\n{mock_quixel_server.asset_types[0]}\n", mock, base_url)
+
+            if "download" in args.scenarios:
+                results.append(result)
+
+        if "checksums" in args.scenarios:
+            print("Running calculate_all_checksums.py...")
+            (assets_path / "verification_cache.json").unlink(missing_ok=True)
+            results.append(run_script("calculate_all_checksums.py", assets_path, f"{assets_path}\n", mock, base_url, bytes_read=zip_bytes))
+
+        if "images" in args.scenarios:
+            print("Running download_all_images.py...")
+            images_path = folder("images")
+            write_complete_metadata(seeded_assets[:args.download_assets], images_path)
+            results.append(run_script("download_all_images.py", images_path, f"{images_path}\n", mock, base_url))
+    finally:
+        server.shutdown()
+
+        if not args.work_dir and not args.keep:
+            shutil.rmtree(work_path, ignore_errors=True)
+
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the scripts against a local mock Quixel server.")
+    parser.add_argument("scenarios", nargs="*", default=["basic", "complete", "sync", "download", "checksums", "images"], help="Any of basic, complete, sync, download, checksums and images (default: all)")
+    parser.add_argument("--crawl-assets", type=int, default=100, help="Number of seeded assets the mock server lists (default: 100)")
+    parser.add_argument("--download-assets", type=int, default=20, help="Number of assets downloaded by the download scenario (default: 20)")
+    parser.add_argument("--latency", type=float, default=0.02, help="Seconds added to every response (default: 0.02)")
+    parser.add_argument("--error-rate", type=float, default=0, help="Fraction of requests answered with a 503 (default: 0)")
+    parser.add_argument("--payload-size", type=float, default=8, help="Size of each asset zip in MB (default: 8)")
+    parser.add_argument("--image-size", type=float, default=256, help="Size of each preview image in KB (default: 256)")
+    parser.add_argument("--token-lifetime", type=float, default=0, help="Seconds each token the mock server issues is valid for, to test token refreshing (default: 0, never expires)")
+    parser.add_argument("--packaging-time", type=float, default=0, help="Most seconds a download request takes to answer, like the servers preparing a zip. Varies by asset. (default: 0)")
+    parser.add_argument("--download-id-lifetime", type=float, default=0, help="Seconds each download ID is valid for (default: 0, never expires)")
+    parser.add_argument("--work-dir", help="Folder to run in, kept afterwards (default: a temporary folder)")
+    parser.add_argument("--keep", action="store_true", help="Keep the temporary folder afterwards")
+    parser.add_argument("--output", help="Also save the results to this JSON file")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args)
+
+    print(f"\n{"script":<38}{"exit":>5}{"seconds":>10}{"requests":>10}{"conns":>7}{"req/s":>9}{"MB":>10}{"MB/s":>9}{"peak RSS MB":>13}")
+    for result in results:
+        print(f"{result["script"]:<38}{result["exit_code"]:>5}{result["seconds"]:>10}{result["requests"]:>10}{result["connections"]:>7}{result["requests_per_second"]:>9}{result["megabytes"]:>10}{result["megabytes_per_second"]:>9}{str(result["peak_rss_megabytes"]):>13}")
+
+    for result in results:
+        if result["requests"] >= 20 and result["connections"] > result["requests"] / 4: # Each kept-alive connection should serve many requests
+            print(f"\nWarning: {result["script"]} opened {result["connections"]} connections for {result["requests"]} requests, so it isn't reusing them.")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=4)
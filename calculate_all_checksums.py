@@ -1,34 +1,16 @@
-import json
-import hashlib
-import zipfile
 from pathlib import Path
 from tqdm import tqdm
+import zip_verification
+import checksum_journal
 
 
 # A simple script to mass-calculate the checksum of every asset currently downloaded and save it to checksums.json.
+# Zips are checked in parallel, and zips that haven't changed since the last run are skipped using verification_cache.json.
 
 
-def calculate_checksum(asset, asset_path):
-    with open(asset_path / f"{asset}.zip", "rb", buffering=0) as f:
-        checksum = hashlib.file_digest(f, "sha256").hexdigest()
-    
-    return checksum
+verification_workers = 8 # Number of zips checked at the same time. Lower this if your disks are slow at random reads.
 
 
-def test_zip_file(asset, asset_path):
-    try:
-        zipped_file = zipfile.ZipFile(asset_path / f"{asset}.zip")
-    except zipfile.BadZipfile as ex:
-        return False
-
-    zip_test = zipped_file.testzip()
-
-    if zip_test is not None:
-        return False
-    else:
-        return True
-    
-
 asset_path = Path(input("Enter the FULL path of the folder with your assets: "))
 
 zip_names = sorted([zip.name.split(".zip")[0] for zip in asset_path.glob('*.zip')])
@@ -37,13 +19,12 @@ print(f"\n{len(zip_names)} zips in directory selected. Saving checksums to check
 
 checksums = {}
 
-with open(asset_path / "checksums.json", "w", encoding="utf-8") as c:
-    for asset in tqdm(zip_names):
-        if test_zip_file(asset, asset_path):
-            checksums[asset] = calculate_checksum(asset, asset_path)
-        else:
-            print(f"Zip for {asset} was bad! Skipping checksum calculation.")
-    
-    print("\nChecksum calculation done! Saving...")
+for asset, good, checksum in tqdm(zip_verification.verify_zip_files(asset_path, zip_names, verification_workers), total=len(zip_names)):
+    if good:
+        checksums[asset] = checksum
+    else:
+        print(f"Zip for {asset} was bad! Skipping checksum calculation.")
+
+print("\nChecksum calculation done! Saving...")
 
-    json.dump(checksums, c, ensure_ascii=False, indent=4)
\ No newline at end of file
+checksum_journal.write_checksums(dict(sorted(checksums.items())), asset_path)
@@ -1,35 +1,31 @@
-import zipfile
 from pathlib import Path
 from tqdm import tqdm
+import zip_verification
 
 
-def test_zip_file(asset, asset_path):
-    try:
-        zipped_file = zipfile.ZipFile(asset_path / f"{asset}.zip")
-    except zipfile.BadZipfile as ex:
-        return False
+# Zips are checked in parallel, and zips that haven't changed since the last run are skipped using verification_cache.json.
+# By default only the structure of each zip is checked, which takes minutes even for a complete archive. Set verification_level to "crc" or "full" to decompress every member as well (see zip_verification.py).
 
-    zip_test = zipped_file.testzip()
 
-    if zip_test is not None:
-        return False
-    else:
-        return True
+verification_workers = 8 # Number of zips checked at the same time. Lower this if your disks are slow at random reads.
+verification_level = "structural" # "structural", "crc" or "full"
 
 
 asset_path = Path(input("Enter the FULL path of the folder with your assets: "))
 
 zip_names = sorted([zip.name.split(".zip")[0] for zip in asset_path.glob('*.zip')])
 
-print(f"\n{len(zip_names)} zips in directory selected. Checking.")
+print(f"\n{len(zip_names)} zips in directory selected. Checking ({verification_level}).")
 
 bad_assets = []
 
-for asset in tqdm(zip_names):
-    if not test_zip_file(asset, asset_path):
+for asset, good, checksum in tqdm(zip_verification.verify_zip_files(asset_path, zip_names, verification_workers, verification_level), total=len(zip_names)):
+    if not good:
         print(f"{asset} is bad! Remove it from your checksum file.")
         bad_assets.append(asset)
 
+bad_assets.sort()
+
 if len(bad_assets) > 0:
     with open(asset_path / "bad_assets.txt", "w", encoding="utf-8") as f:
         f.write("\n".join(bad_assets))
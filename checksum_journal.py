@@ -0,0 +1,85 @@
+import os
+import json
+
+
+# Keeps checksums.json up to date without rewriting the whole file after every asset. Not meant to be run on its own.
+# New checksums are appended to checksums.journal.jsonl (one small synced write per asset) and merged into checksums.json every so often.
+# Loading always replays the journal on top of checksums.json, so quitting at any point leaves nothing broken.
+
+
+compact_interval = 500 # Number of journaled checksums before they are merged into checksums.json
+
+
+def load_checksums(asset_path):
+    try:
+        with open(asset_path / "checksums.json", "r", encoding="utf-8") as f:
+            checksums = json.load(f)
+    except FileNotFoundError:
+        checksums = {}
+
+    journal_path = asset_path / "checksums.journal.jsonl"
+    good_length = 0
+
+    try:
+        with open(journal_path, "rb") as f:
+            while line := f.readline():
+                if not line.endswith(b"\n"): # Cut off by a crash mid-write
+                    break
+
+                entry = json.loads(line)
+                checksums[entry["asset"]] = entry["checksum"]
+                good_length += len(line)
+    except FileNotFoundError:
+        return checksums
+
+    if good_length != journal_path.stat().st_size:
+        os.truncate(journal_path, good_length)
+
+    return checksums
+
+
+def write_checksums(checksums, asset_path):
+    # Replaces checksums.json in one step and clears the journal, whose entries are now part of it
+    temp_path = asset_path / "checksums.json.tmp"
+
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(checksums, f, ensure_ascii=False, indent=4)
+        f.flush()
+        os.fsync(f.fileno())
+
+    os.replace(temp_path, asset_path / "checksums.json")
+    (asset_path / "checksums.journal.jsonl").unlink(missing_ok=True)
+
+
+class ChecksumJournal:
+    # Use load_checksums first, then record() every new checksum and close() when done
+
+    def __init__(self, checksums, asset_path):
+        self.checksums = checksums
+        self.asset_path = asset_path
+        self.journal = open(asset_path / "checksums.journal.jsonl", "ab")
+        self.journaled = 0
+
+    def record(self, asset, checksum):
+        self.checksums[asset] = checksum
+
+        self.journal.write(json.dumps({"asset": asset, "checksum": checksum}).encode("utf-8") + b"\n")
+        self.journal.flush()
+        os.fsync(self.journal.fileno())
+        self.journaled += 1
+
+        if self.journaled >= compact_interval:
+            self.compact()
+
+    def compact(self):
+        self.journal.close()
+        write_checksums(self.checksums, self.asset_path)
+        self.journal = open(self.asset_path / "checksums.journal.jsonl", "ab")
+        self.journaled = 0
+
+    def close(self):
+        if self.journaled > 0:
+            self.journal.close()
+            write_checksums(self.checksums, self.asset_path)
+        else:
+            self.journal.close()
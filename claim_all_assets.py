@@ -1,30 +1,28 @@
-import requests
 import json
-import copy
-import time
-import random
+from pathlib import Path
 from tqdm import tqdm
+import quixel_client
+import quixel_credentials
+import metadata_store
 
 
 # This script should be run after get_all_basic_asset_metadata.py. It requires an instantiated asset_metadata.json file with all asset IDs - however, it does not require complete asset metadata.
 # If you want to download assets, make sure you run this script BEFORE running download_all_assets.py! Quixel refuses download requests for any unowned assets.
 
 
-def extract_token(token):
-    if token.startswith("token:\""): # Copying from Firefox dev tools, remove extra json data
-        token = token.removeprefix("token:\"")
-        token = token.removesuffix("\"")
-    elif token.startswith("{\"token\":\""): # Copying from Chrome dev tools, remove extra json data
-        token = token.split("\":\"")[1].split("\",\"")[0]
+requests_per_second = 1 # Claims sent to the Quixel servers per second at first. quixel_client adjusts it to what the servers can handle, unless adaptive_pacing is turned off there.
 
-    return token
 
+rate_limiter = quixel_client.AdaptiveLimiter("acl", requests_per_second)
+
+
+def check_already_claimed(credentials):
+    backoff = quixel_client.Backoff("acquired")
 
-def check_already_claimed(token):
     while True:
-        headers = {"Authorization": token}
+        headers = {"Authorization": credentials.get()}
 
-        response = requests.get("https://quixel.com/v1/assets/acquired", headers=headers)
+        response = quixel_client.get("https://quixel.com/v1/assets/acquired", "acquired", headers=headers)
 
         if response.status_code != 200:
             try:
@@ -32,8 +30,7 @@ def check_already_claimed(token):
                 print(f"\nEncountered error {response.status_code}! Here is the response from the Quixel server: {json_response}")
             except json.JSONDecodeError:
                 print(f"\nEncountered error! (Recieved status code {response.status_code} from Quixel server)")
-            print("Waiting 5 seconds and retrying.")
-            time.sleep(5)
+            backoff.wait(response)
         else:
             try:
                 json_response = response.json()
@@ -41,24 +38,29 @@ def check_already_claimed(token):
                 return [asset["assetID"] for asset in json_response]
             except json.JSONDecodeError:
                 print(f"Error on decode! Here is the response: {response}")
-                print("Waiting 5 seconds and retrying.")
-                time.sleep(5)
+                backoff.wait(response)
+
 
+def claim_quixel_asset(credentials, asset):
+    backoff = quixel_client.Backoff("acl")
 
-def claim_quixel_asset(token, asset):
     while True:
+        token = credentials.get()
         headers = {"Authorization": token}
 
-        response = requests.post("https://quixel.com/v1/acl", headers=headers, json={"assetID": asset})
+        response = quixel_client.post("https://quixel.com/v1/acl", "acl", rate_limiter, headers=headers, json={"assetID": asset})
 
         if response.status_code != 200:
             try:
                 json_response = response.json()
                 print(f"\nEncountered error {response.status_code} with asset {asset}! Here is the response from the Quixel server: {json_response}")
+
+                if json_response.get("message") == "Expired token":
+                    credentials.expired(token)
+                    continue # Retried as soon as there's a new token
             except json.JSONDecodeError:
                 print(f"\nEncountered error! (Recieved status code {response.status_code} from Quixel server)")
-            print("Waiting 5 seconds and retrying.")
-            time.sleep(5)
+            backoff.wait(response)
         else:
             try:
                 json_response = response.json()
@@ -72,56 +74,51 @@ def claim_quixel_asset(token, asset):
                         break
                     elif json_response["isError"]: # This might happen if the token invalidates midway, but it's not super difficult to just restart the script to resume.
                         print(f"The server accepted the request, but returned an error. Here is the response: {json_response}")
-                        print("Waiting 5 seconds and retrying.")
-                        time.sleep(5)
+                        backoff.wait(response)
                 else:
                     # Success!
                     break
             except json.JSONDecodeError:
                 print(f"Error on decode! Here is the response: {response}")
-                print("Waiting 5 seconds and retrying.")
-                time.sleep(5)
+                backoff.wait(response)
 
 
 def claim_all_assets(asset_metadata):
-    token = extract_token(input("Enter your Quixel token (refer to the readme for instructions): "))
+    credentials = quixel_credentials.CredentialProvider("Enter your Quixel token (refer to the readme for instructions): ")
 
-    print(f"\n{asset_metadata["total"]} total assets in asset metadata.")
+    print(f"\n{asset_metadata.total} total assets in asset metadata.")
     print("Checking currently claimed assets via Quixel servers...")
-    claimed = check_already_claimed(token)
+    claimed = check_already_claimed(credentials)
 
     print(f"\nDetected {len(claimed)} currently claimed assets.")
 
-    TEMP_unclaimed_asset_list = copy.deepcopy(list(asset_metadata["asset_metadata"].keys())) # It's my experience that Python is prone to doing strange things with object references, so this is just another sanity check
-    unclaimed_asset_list = list(set(claimed) ^ set(TEMP_unclaimed_asset_list)) # Perform the opposite of a list intersection
+    claimed_set = set(claimed)
+    unclaimed_assets = (asset_id for asset_id in asset_metadata.ids() if asset_id not in claimed_set) # Asset IDs are read as claiming goes, so there's no waiting for the whole metadata file to load
+    claim_count = 0
 
-    print(f"\n{len(unclaimed_asset_list)} assets to claim.")
-    print("There is an artificial, random delay of between 0.1 and 1 second between each request to reduce load on the Quixel servers, so expect to wait several hours.")
+    print(f"\nAbout {max(asset_metadata.total - len(claimed), 0)} assets to claim.")
+    print(f"Claims start at {requests_per_second} per second and adjust to what the Quixel servers can handle, so expect to wait several hours.")
     print("If the script breaks for some reason, no worries - restart it and it will resume right where it left off!\n")
 
-    for asset_id in tqdm(unclaimed_asset_list):
-        claim_quixel_asset(token, asset_id)
-        time.sleep(round(random.uniform(0.1, 1), 2))
+    for asset_id in tqdm(unclaimed_assets, total=max(asset_metadata.total - len(claimed), 0)):
+        claim_quixel_asset(credentials, asset_id)
+        claim_count += 1
 
-    print(f"\nFinished claiming {len(unclaimed_asset_list)} assets!")
+    print(f"\nFinished claiming {claim_count} assets!")
     print("Checking currently claimed assets via Quixel servers...")
 
-    claimed = check_already_claimed(token)
+    claimed = check_already_claimed(credentials)
 
-    if len(claimed) == asset_metadata["total"]:
-        print(f"\nAll {asset_metadata["total"]} assets claimed successfully!")
+    if len(claimed) == asset_metadata.total:
+        print(f"\nAll {asset_metadata.total} assets claimed successfully!")
     else: # This really shouldn't be possible, but again, sanity check
-        print(f"\nCould not verify that all {asset_metadata["total"]} assets have been claimed! Try running this script one more time.")
-
-
-print("Loading asset_metadata.json! Depending on if you ran get_all_complete_asset_metadata.py before this, this could take a bit.\n")
+        print(f"\nCould not verify that all {asset_metadata.total} assets have been claimed! Try running this script one more time.")
 
 
 asset_metadata = None
 
 try:
-    with open("asset_metadata.json", "r", encoding="utf-8") as f:
-        asset_metadata = json.load(f)
+    asset_metadata = metadata_store.open_metadata(Path("."), fields=[]) # Only asset IDs are needed, so asset_metadata.json is streamed instead of loaded
 except FileNotFoundError:
     print("Couldn't find asset_metadata.json! Have you run get_all_basic_asset_metadata.py yet?\n")
     input("Press Enter to exit...")
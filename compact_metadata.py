@@ -0,0 +1,139 @@
+from array import array
+from operator import attrgetter
+from collections.abc import Mapping
+import json
+import metadata_files
+import metadata_stream
+
+
+# Holds asset metadata in a fraction of the memory plain dicts and lists take, for scripts that need all of it at once. Not meant to be run on its own.
+# Objects become read-only records with one __slots__ class per set of keys, lists become tuples (or arrays when they only hold numbers), and short repeated strings like component types and mime types are stored once.
+# Records work like read-only dicts (record["key"], record.get("key"), "key" in record, .items(), ...) and turn back into exactly the original JSON through to_plain() or json.dumps(..., default=json_default).
+
+
+intern_length = 64 # Strings up to this many characters are shared between every place they appear. Longer strings (like URIs) are rarely repeated.
+
+
+strings = {}
+shapes = {} # {(key, ...): record class}
+
+
+class Record(Mapping):
+    # Base class of the generated record classes, each of which has a fixed set of keys
+    __slots__ = ()
+    _keys = ()
+    _getters = {}
+
+    def __getitem__(self, key):
+        return self._getters[key](self)
+
+    def __contains__(self, key):
+        return key in self._getters
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __repr__(self):
+        return f"Record({dict(self.items())!r})"
+
+
+def get_record_class(keys):
+    record_class = shapes.get(keys)
+
+    if record_class is None:
+        slots = tuple(f"_{index}" for index in range(len(keys))) # Keys aren't always valid attribute names, so slots are numbered
+
+        # A generated __init__ that sets each slot directly is several times faster than looping over them, the same trick namedtuple uses
+        namespace = {}
+        exec(f"def __init__(self{"".join(f", {slot}" for slot in slots)}):\n" + "".join(f"    self.{slot} = {slot}\n" for slot in slots) + "    pass\n", namespace)
+
+        record_class = type("Record", (Record,), {"__slots__": slots,
+                                                  "__init__": namespace["__init__"],
+                                                  "_keys": keys,
+                                                  "_getters": {key: attrgetter(slot) for key, slot in zip(keys, slots)}})
+        shapes[keys] = record_class
+
+    return record_class
+
+
+def intern_string(value):
+    if len(value) > intern_length:
+        return value
+
+    return strings.setdefault(value, value)
+
+
+def compact_list(values):
+    if not values:
+        return ()
+
+    # Number lists are stored unboxed, but only when every item has the same type so ints and floats come back exactly as they were
+    first_type = type(values[0])
+
+    if first_type is int and all(type(value) is int for value in values):
+        try:
+            return array("q", values)
+        except OverflowError:
+            pass
+    elif first_type is float and all(type(value) is float for value in values):
+        return array("d", values)
+
+    return tuple([compact_value(value) for value in values])
+
+
+def compact_value(value):
+    # For values whose objects are already records
+    value_type = type(value)
+
+    if value_type is str:
+        return strings.setdefault(value, value) if len(value) <= intern_length else value
+    elif value_type is list:
+        return compact_list(value)
+
+    return value
+
+
+def make_record(pairs):
+    # json's object_pairs_hook, called for every object from the innermost out, so its values are already compacted apart from lists and strings
+    keys = tuple([pair[0] for pair in pairs])
+    record_class = shapes.get(keys) or get_record_class(tuple([intern_string(key) for key in keys]))
+
+    return record_class(*[compact_value(pair[1]) for pair in pairs])
+
+
+def to_plain(value):
+    if isinstance(value, Record):
+        return {key: to_plain(item) for key, item in value.items()}
+    elif isinstance(value, (tuple, array)):
+        return [to_plain(item) for item in value]
+
+    return value
+
+
+def json_default(value):
+    # For json.dump's default argument, which calls this for every record and array it finds
+    if isinstance(value, Record):
+        return dict(value.items())
+    elif isinstance(value, array):
+        return value.tolist()
+
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def load_compact(metadata_path):
+    # Returns asset_metadata.json as json.load would, except that every asset is a record. Assets are read one at a time, so the file is never fully in memory as dicts.
+    asset_metadata = {}
+
+    with metadata_files.open_read(metadata_path) as f:
+        stream = metadata_stream.JsonStream(f, json.JSONDecoder(object_pairs_hook=make_record)) # Records are built while decoding, without making dicts first
+
+        for key in stream.iter_object():
+            if key == "asset_metadata":
+                asset_metadata[key] = {asset_id: stream.read_value() for asset_id in stream.iter_object()}
+            else:
+                asset_metadata[key] = to_plain(stream.read_value())
+
+    return asset_metadata
@@ -0,0 +1,145 @@
+import os
+
+try:
+    import fcntl
+except ImportError: # Windows
+    fcntl = None
+
+
+# Stores every downloaded file once, keyed by its SHA-256, so identical files (like preview images shared between assets) only take up space once. Not meant to be run on its own.
+# The store is a content_store folder next to the downloads. Downloaded files stay where they always were, but identical ones become links to the same stored copy.
+# Files are never copied into the store, the first file with a given hash is simply linked into it. Used by download_all_assets.py, download_all_images.py and deduplicate_files.py.
+
+
+link_mode = "hardlink" # "hardlink" works on almost every filesystem. "reflink" makes copy-on-write clones instead (btrfs, XFS, ...), so identical files stay independent copies that still share disk space.
+
+
+FICLONE = 0x40049409 # Linux ioctl that clones one file into another
+
+
+def reflink(source, destination):
+    with open(source, "rb") as source_file, open(destination, "wb") as destination_file:
+        fcntl.ioctl(destination_file.fileno(), FICLONE, source_file.fileno())
+
+
+def link(source, destination):
+    if link_mode == "reflink" and fcntl is not None:
+        try:
+            reflink(source, destination)
+            return
+        except OSError: # Not supported by this filesystem, hardlinks it is
+            destination.unlink(missing_ok=True)
+
+    os.link(source, destination)
+
+
+def same_file(first_path, second_path):
+    if link_mode == "reflink": # Clones can't be told apart from copies, so they're just cloned again, which is harmless
+        return False
+
+    return os.path.samefile(first_path, second_path)
+
+
+class ContentStore:
+    # Only used from one thread at a time
+
+    def __init__(self, folder):
+        self.path = folder / "content_store"
+        self.reclaimed = 0 # Bytes saved by this ContentStore so far
+        self.deduplicated = 0 # Files replaced by a link so far
+        self.enabled = True
+
+    def object_path(self, sha256):
+        return self.path / sha256[:2] / sha256
+
+    def has(self, sha256):
+        return self.enabled and self.object_path(sha256).exists()
+
+    def add(self, file_path, sha256):
+        # Links file_path into the store, or replaces it with a link to the stored copy if the store already has its content. Returns the bytes saved.
+        if not self.enabled:
+            return 0
+
+        object_path = self.object_path(sha256)
+
+        try:
+            if not object_path.exists():
+                object_path.parent.mkdir(parents=True, exist_ok=True)
+                link(file_path, object_path)
+                return 0
+
+            if same_file(file_path, object_path):
+                return 0
+
+            size = file_path.stat().st_size
+
+            if object_path.stat().st_size != size: # The stored copy got damaged somehow, keep the new file instead
+                object_path.unlink()
+                link(file_path, object_path)
+                return 0
+
+            self.place(object_path, file_path)
+        except OSError as ex:
+            print(f"\nCouldn't use the content store in {self.path}, so files won't be deduplicated. Exception was {ex}")
+            self.enabled = False
+            return 0
+
+        self.reclaimed += size
+        self.deduplicated += 1
+
+        return size
+
+    def restore(self, sha256, file_path):
+        # Puts the stored copy of sha256 at file_path, returns False if the store doesn't have it
+        if not self.has(sha256):
+            return False
+
+        try:
+            file_path.parent.mkdir(parents=True, exist_ok=True)
+            self.place(self.object_path(sha256), file_path)
+        except OSError as ex:
+            print(f"\nCouldn't restore {file_path} from the content store, it will be downloaded instead. Exception was {ex}")
+            return False
+
+        return True
+
+    def place(self, object_path, file_path):
+        # The link is made next to file_path first, so file_path is never missing or half-written
+        temp_path = file_path.with_name(file_path.name + ".link")
+        temp_path.unlink(missing_ok=True)
+        link(object_path, temp_path)
+        os.replace(temp_path, file_path)
+
+    def iter_objects(self):
+        for object_path in self.path.glob("*/*"):
+            if len(object_path.name) == 64:
+                yield object_path
+
+    def report(self):
+        # Returns (stored files, bytes all linked files would take without the store, bytes they actually take). Only accurate for hardlinks, clones can't be told apart from copies.
+        objects = logical = physical = 0
+
+        for object_path in self.iter_objects():
+            stat = object_path.stat()
+            objects += 1
+            physical += stat.st_size
+            logical += stat.st_size * max(stat.st_nlink - 1, 1)
+
+        return objects, logical, physical
+
+    def prune(self):
+        # Removes stored files that nothing links to anymore (hardlinks only). Returns the number removed and the bytes freed.
+        removed = freed = 0
+
+        if link_mode != "hardlink":
+            return removed, freed
+
+        for object_path in self.iter_objects():
+            stat = object_path.stat()
+
+            if stat.st_nlink == 1:
+                object_path.unlink()
+                removed += 1
+                freed += stat.st_size
+
+        return removed, freed
@@ -0,0 +1,31 @@
+from pathlib import Path
+import metadata_files
+import metadata_store
+
+
+# Converts asset_metadata.json into asset_metadata.db (an indexed SQLite copy that download_all_assets.py, download_all_images.py and claim_all_assets.py can use instead) and back.
+# Scripts prefer asset_metadata.db when it is present. If asset_metadata.json has changed since, they warn and read asset_metadata.json instead, so remember to convert again after updating it.
+# asset_metadata.json can also be compressed (see metadata_files.py). Exports are written as metadata_files.new_metadata_name, indented only if metadata_files.pretty_json is set.
+
+
+asset_path = Path(input("Enter the FULL path of the folder asset_metadata.json or asset_metadata.db is in: "))
+direction = input("\nType \"import\" to create asset_metadata.db from asset_metadata.json, or \"export\" to create asset_metadata.json from asset_metadata.db: ").strip().lower()
+
+if direction == "import":
+    metadata_path = metadata_files.find_metadata(asset_path) # asset_metadata.json, or a compressed copy of it
+
+    if metadata_path is None:
+        print(f"\nCouldn't find asset_metadata.json in the directory you selected, {asset_path}")
+    else:
+        print(f"\nImporting {metadata_path.name}... (this can take a while with complete metadata)")
+        count = metadata_store.import_json(metadata_path, asset_path / "asset_metadata.db")
+        print(f"\nImported {count} assets to asset_metadata.db!")
+elif direction == "export":
+    if not (asset_path / "asset_metadata.db").exists():
+        print(f"\nCouldn't find asset_metadata.db in the directory you selected, {asset_path}")
+    else:
+        print("\nExporting asset_metadata.db...")
+        count = metadata_store.export_json(asset_path / "asset_metadata.db", asset_path / metadata_files.new_metadata_name)
+        print(f"\nExported {count} assets to {metadata_files.new_metadata_name}!")
+else:
+    print(f"\nUnknown option {direction}!")
@@ -0,0 +1,78 @@
+import json
+import hashlib
+from pathlib import Path
+from tqdm import tqdm
+import checksum_journal
+import content_store
+import download_planner
+
+
+# Adds already downloaded assets and images to the content store (see content_store.py), so identical files only take up space once, and reports how much space that saves.
+# Zips are stored under the checksums download_all_assets.py saved, so they aren't hashed again. Images are hashed once if image_manifest.jsonl has no hash for them yet, and the hash is added to the manifest.
+# Stored files that no downloaded file links to anymore are removed at the end. To keep new downloads deduplicated, set deduplicate_assets in download_all_assets.py and deduplicate_images in download_all_images.py.
+
+
+def hash_file(file_path):
+    checksum = hashlib.sha256()
+
+    with open(file_path, "rb", buffering=0) as f:
+        while chunk := f.read((1024*1024)*8):
+            checksum.update(chunk)
+
+    return checksum.hexdigest()
+
+
+def add_assets(store, asset_path):
+    checksums = checksum_journal.load_checksums(asset_path)
+
+    for asset, checksum in tqdm(checksums.items(), desc="Assets"):
+        zip_path = asset_path / f"{asset}.zip"
+
+        if zip_path.exists():
+            store.add(zip_path, checksum)
+
+
+def add_images(store, image_path):
+    manifest_path = image_path / "image_manifest.jsonl"
+    manifest = {}
+
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.endswith("\n"):
+                entry = json.loads(line)
+                manifest[entry["uri"]] = entry
+
+    with open(manifest_path, "a", encoding="utf-8") as f:
+        for uri, entry in tqdm(manifest.items(), desc="Images"):
+            new_image_path = image_path / uri
+
+            if not new_image_path.exists() or new_image_path.stat().st_size != entry["size"]:
+                continue
+
+            if not entry.get("sha256"): # Downloaded before images were hashed, the last line for an image is the one that counts
+                entry["sha256"] = hash_file(new_image_path)
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+            store.add(new_image_path, entry["sha256"])
+
+
+folder = Path(input("Enter the FULL path of the folder with the downloaded assets or images: "))
+store = content_store.ContentStore(folder)
+has_assets = (folder / "checksums.json").exists() or (folder / "checksums.journal.jsonl").exists()
+has_images = (folder / "image_manifest.jsonl").exists()
+
+if not has_assets and not has_images:
+    print(f"\nCouldn't find checksums.json or image_manifest.jsonl in the directory you selected, {folder}")
+else:
+    if has_assets:
+        add_assets(store, folder)
+    if has_images:
+        add_images(store, folder)
+
+    removed, freed = store.prune()
+    objects, logical, physical = store.report()
+
+    print(f"\n{store.deduplicated} files were replaced by links, reclaiming {download_planner.format_size(store.reclaimed)}.")
+    if removed:
+        print(f"Removed {removed} stored files nothing links to anymore, freeing {download_planner.format_size(freed)}.")
+    print(f"The content store holds {objects} files. Without it, they would take {download_planner.format_size(logical)}, they take {download_planner.format_size(physical)}.")
@@ -0,0 +1,94 @@
+import os
+import errno
+
+
+# Writes large downloads (like asset zips, which can be several GB) to disk with as little overhead as possible. Not meant to be run on its own.
+# The whole file is reserved on disk before the first byte arrives, so the drive can lay it out in one piece and a full drive is noticed right away instead of halfway through.
+# Written bytes are dropped from the page cache once they're safely on disk, so a multi-GB download doesn't push everything else out of memory.
+# Chunks arrive as new bytes objects. urllib3's readinto() would read each one into a new bytes object and copy it into the buffer anyway, so reusing a buffer for the connection saves nothing.
+# Reserving space and dropping cached bytes only work where the OS supports them (Linux, mostly), everywhere else files are written normally.
+
+
+preallocate = True # Set to False to not reserve the whole file up front, like on filesystems that handle it badly (ZFS, network drives)
+drop_from_cache = True # Set to False to keep written bytes in the page cache, if you read the zips again right after downloading them
+buffer_size = (1024*1024)*8 # Bytes read from the connection (or a .part file being resumed) at a time
+sync_interval = (1024*1024)*256 # Bytes written between making sure they're on disk, which is also as far back as a download can have to resume from after a crash
+
+
+def progress_path(part_path):
+    return part_path.with_name(part_path.name + ".written")
+
+
+def written_length(part_path):
+    # How much of a .part file holds downloaded bytes. A preallocated one is full size from the start, so while it's being written the real length is kept next to it.
+    try:
+        size = part_path.stat().st_size
+    except FileNotFoundError:
+        return 0
+
+    try:
+        return min(int(progress_path(part_path).read_text(encoding="utf-8")), size)
+    except (FileNotFoundError, ValueError):
+        return size
+
+
+class PartFile:
+    def __init__(self, part_path, offset, total_length):
+        # Continues writing part_path at offset (the written_length() of it), for a download that ends up total_length bytes long
+        self.part_path = part_path
+        self.written = offset
+        self.synced = offset
+        self.preallocated = False # Whether the rest of the file is already reserved on disk
+        self.file = open(part_path, "r+b" if offset > 0 else "wb", buffering=0) # Buffering would only copy every chunk once more
+
+        self.file.seek(offset)
+        self.record_progress() # Before preallocating, so a crash never leaves reserved bytes looking downloaded
+
+        if preallocate and hasattr(os, "posix_fallocate") and total_length > offset:
+            try:
+                os.posix_fallocate(self.file.fileno(), offset, total_length - offset)
+                self.preallocated = True
+            except OSError as ex:
+                if ex.errno not in (errno.EOPNOTSUPP, errno.EINVAL): # Filesystems that can't do it still get written to, running out of space doesn't
+                    self.file.truncate(offset) # Some of it may have been reserved anyway
+                    self.file.close()
+                    raise
+
+    def write(self, chunk):
+        view = memoryview(chunk)
+
+        while view: # Unbuffered writes can be partial
+            view = view[self.file.write(view):]
+
+        self.written += len(chunk)
+
+        if self.written - self.synced >= sync_interval:
+            self.sync()
+
+    def sync(self):
+        # Makes sure everything written so far is on disk, so a resumed download can trust it
+        os.fsync(self.file.fileno())
+        self.record_progress()
+
+        if drop_from_cache and hasattr(os, "posix_fadvise"): # Only clean pages can be dropped, which they are once synced
+            os.posix_fadvise(self.file.fileno(), 0, self.written, os.POSIX_FADV_DONTNEED)
+
+        self.synced = self.written
+
+    def record_progress(self):
+        temp_path = progress_path(self.part_path).with_suffix(".tmp") # Replaced in one go, so a crash leaves either the old length or the new one
+
+        with open(temp_path, "w", encoding="utf-8") as f:
+            f.write(str(self.written))
+
+        temp_path.replace(progress_path(self.part_path))
+
+    def close(self):
+        # Gives back any reserved space that wasn't written to, so the .part file is exactly as long as what was downloaded
+        try:
+            self.file.truncate(self.written)
+            self.sync()
+        finally:
+            self.file.close()
+
+        progress_path(self.part_path).unlink(missing_ok=True)
@@ -1,15 +1,45 @@
-import requests
+import os
+import sys
 import json
+import errno
 import time
+import queue
 import hashlib
-import zipfile
+import shutil
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from tqdm import tqdm
+import quixel_client
+import metadata_store
+import quixel_metrics
+import checksum_journal
+import zip_verification
+import download_planner
+import content_store
+import sharding
+import asset_index
+import quixel_credentials
+import disk_writer
 
 
 # All possible component types: albedo, ao, brush, bump, cavity, curvature, diffuse, displacement, displacment, f, fuzz, gloss, mask, metalness, normal, normalbump, normalobject, occlusion, opacity, roughness, specular, thickness, translucency, transmission
 
 # This script should be run with a COMPLETE asset_metadata.json file in the directory you wish to download assets to. Simply copy it from the directory this script is in. Also, be sure that you have claimed all assets.
+# To split the download between several machines, run it with --shard i/N on each of them (see sharding.py).
+
+
+download_workers = 4 # Number of assets downloaded at the same time. A single connection rarely saturates a fast link, but set this to 1 to download one asset at a time.
+requests_per_second = 4 # Download requests sent to the Quixel servers per second at first, across all workers. quixel_client adjusts it to what the servers can handle, unless adaptive_pacing is turned off there.
+verification_level = "structural" # How downloaded zips are checked when they can't be checked while downloading (see zip_verification.py): "structural" (instant), "crc" or "full" (decompresses everything again)
+prefetch_ahead = 4 # Download IDs requested ahead of the downloads that use them, so the servers package the next zips while the current ones are still downloading. Set to 0 to request each one just as its download starts.
+download_id_lifetime = 600 # Seconds a download ID is trusted for. Older ones are requested again instead of being used, as are ones the download server no longer knows.
+deduplicate_assets = False # Set to True to store identical zips only once, linking the copies to each other (see content_store.py). Uses the checksums that are calculated anyway, so nothing is hashed twice.
+
+
+request_limiter = quixel_client.AdaptiveLimiter("downloads", requests_per_second, download_workers + prefetch_ahead, latency_sensitive=False) # Prefetched download IDs are requested alongside the downloads. Packaging takes longer for bigger assets, so only errors slow it down.
+download_limiter = quixel_client.AdaptiveLimiter("assetdownloads", requests_per_second, download_workers)
+stop_event = quixel_client.stop_event # Set on Ctrl+C so workers stop retrying and exit
+space_reservations = download_planner.SpaceReservations()
 
 
 def save_asset_metadata(asset_metadata, asset_path):
@@ -17,87 +47,144 @@ def save_asset_metadata(asset_metadata, asset_path):
         json.dump(asset_metadata, f, ensure_ascii=False, indent=4)
 
 
-def save_checksums(checksums, asset_path):
-    with open(asset_path / "checksums.json", "w", encoding="utf-8") as f:
-        json.dump(checksums, f, ensure_ascii=False, indent=4)
+def test_downloaded_zip(zip_path, verifier, asset_length):
+    zip_result = zip_verification.verify_streamed_zip(zip_path, verifier)
 
+    if zip_result is None: # The zip couldn't be checked while streaming, so fall back to checking it on disk
+        zip_result = zip_verification.test_zip(zip_path, verification_level, asset_length)
 
-def extract_token(token):
-    if token.startswith("token:\""): # Copying from Firefox dev tools, remove extra json data
-        token = token.removeprefix("token:\"")
-        token = token.removesuffix("\"")
-    elif token.startswith("{\"token\":\""): # Copying from Chrome dev tools, remove extra json data
-        token = token.split("\":\"")[1].split("\",\"")[0]
+    return zip_result
 
-    return token
 
+def get_range_start(response):
+    # Content-Range looks like "bytes 1000-1999/2000", returns the start offset and the total size
+    try:
+        byte_range, total = response.headers["Content-Range"].removeprefix("bytes ").split("/")
 
-def calculate_checksum(asset, asset_path):
-    with open(asset_path / f"{asset}.zip", "rb", buffering=0) as f:
-        checksum = hashlib.file_digest(f, "sha256").hexdigest()
-    
-    return checksum
+        return int(byte_range.split("-")[0]), int(total)
+    except (KeyError, ValueError):
+        return None, None
 
 
-def test_zip_file(asset, asset_path):
-    try:
-        zipped_file = zipfile.ZipFile(asset_path / f"{asset}.zip")
-    except zipfile.BadZipfile as ex:
-        return False
+def seed_from_part(part_path, offset, checksum, verifier):
+    # Hashes and checks the already downloaded part of a resumed download, so the finished zip never has to be read back in full
+    view = memoryview(bytearray(disk_writer.buffer_size)) # Files can be read straight into it, unlike responses
 
-    zip_test = zipped_file.testzip()
+    with open(part_path, "rb", buffering=0) as f:
+        while offset > 0 and (count := f.readinto(view[:min(len(view), offset)])): # Anything past offset was only reserved, not downloaded
+            checksum.update(view[:count])
+            verifier.update(view[:count])
+            offset -= count
 
-    if zip_test is not None:
-        return False
-    else:
-        return True
 
+def download_quixel_asset(asset, asset_path, download_id, bar_position):
+    # Returns the zip's checksum, None if it was stopped, or False if the download ID has expired
+    backoff = quixel_client.Backoff("assetdownloads")
+    zip_path = asset_path / f"{asset}.zip"
+    part_path = asset_path / f"{asset}.zip.part" # Downloads go here first and are only moved to the .zip once they pass verification
 
-def download_quixel_asset(asset, asset_path, download_id):
-    while True:
-        response = requests.get(f"https://assetdownloads.quixel.com/download/{download_id}?preserveStructure=true&url=https://quixel.com/v1/downloads", stream=True)
+    while not stop_event.is_set():
+        offset = disk_writer.written_length(part_path)
+        headers = {"Range": f"bytes={offset}-"} if offset > 0 else {}
 
-        if response.status_code != 200:
+        response = quixel_client.get(f"https://assetdownloads.quixel.com/download/{download_id}?preserveStructure=true&url=https://quixel.com/v1/downloads", "assetdownloads", download_limiter, stream=True, headers=headers)
+
+        if response.status_code == 416: # The .part file doesn't fit this download, so start over
+            print(f"\nCouldn't resume download for asset {asset}, starting over.")
+            response.close()
+            part_path.unlink(missing_ok=True)
+            disk_writer.progress_path(part_path).unlink(missing_ok=True)
+        elif response.status_code in (404, 410): # The download ID has expired, the .part file is kept for the next one
+            response.close()
+            return False
+        elif response.status_code not in (200, 206):
             try:
                 json_response = response.json()
                 print(f"\nEncountered error {response.status_code} with asset {asset}! Here is the response from the Quixel server: {json_response}")
             except json.JSONDecodeError:
                 print(f"\nEncountered error while downloading asset {asset}! (Recieved status code {response.status_code} and response {response} from Quixel server)")
 
-            print("Waiting 5 seconds and retrying.")
-            time.sleep(5)
+            backoff.wait(response)
         else:
-            asset_length = int(response.headers["Content-Length"])
+            if response.status_code == 206:
+                range_start, asset_length = get_range_start(response)
+
+                if range_start != offset: # Not the range we asked for, don't risk stitching together the wrong bytes
+                    print(f"\nCouldn't resume download for asset {asset}, starting over.")
+                    response.close()
+                    part_path.unlink(missing_ok=True)
+                    disk_writer.progress_path(part_path).unlink(missing_ok=True)
+                    continue
+            else: # The server ignored the range (or there was nothing to resume), so this is the whole zip
+                offset = 0
+                asset_length = int(response.headers["Content-Length"])
+
+            space_reservations.reserve(asset, asset_length - offset) # The real size, now that it's known
+            if not space_reservations.has_room(asset_path, asset, asset_length - offset):
+                print(f"\nNot enough free space for asset {asset} ({download_planner.format_size(asset_length - offset)} left to download), skipping it.")
+                response.close()
+                return None
+
+            checksum = hashlib.sha256() # Hash and check the zip while it's being written instead of reading it back afterwards
+            verifier = zip_verification.StreamingZipVerifier()
 
             try:
-                with open(asset_path / f"{asset}.zip", "wb") as f:
-                    asset_bar = tqdm(desc=f"Downloading asset: {asset}", total=asset_length, unit="B", unit_scale=True, position=1, leave=False)
-
-                    for chunk in response.iter_content(chunk_size=(1024*1024)*8):
-                        f.write(chunk)
+                if offset > 0:
+                    seed_from_part(part_path, offset, checksum, verifier)
+
+                part_file = disk_writer.PartFile(part_path, offset, asset_length)
+                if part_file.preallocated: # Already taken from the free space, counting it as reserved too would count it twice
+                    space_reservations.release(asset)
+                asset_bar = tqdm(desc=f"Downloading asset: {asset}", total=asset_length, initial=offset, unit="B", unit_scale=True, position=bar_position, leave=False)
+
+                try:
+                    for chunk in quixel_metrics.iter_transfer("assetdownloads", response.iter_content(chunk_size=disk_writer.buffer_size)):
+                        if stop_event.is_set():
+                            break
+
+                        part_file.write(chunk)
+                        if not part_file.preallocated:
+                            space_reservations.reserve(asset, asset_length - part_file.written)
+                        checksum.update(chunk)
+                        verifier.update(chunk)
                         asset_bar.update(len(chunk))
-
+                finally:
+                    part_file.close() # Whatever was written is kept for resuming
                     asset_bar.close()
-
-                if (asset_path / f"{asset}.zip").stat().st_size != asset_length:
-                    print(f"\nDownload for asset {asset} was incomplete!")
-                    print("Waiting 5 seconds and retrying.")
-                    time.sleep(5)
-                elif not test_zip_file(asset, asset_path):
+                    response.close() # Gives back the connection and download_limiter's slot if the body wasn't read to the end
+
+                if stop_event.is_set():
+                    return None
+                elif part_file.written != asset_length:
+                    print(f"\nDownload for asset {asset} was incomplete! It will be resumed.")
+                    backoff.wait(response)
+                elif not test_downloaded_zip(part_path, verifier, asset_length):
                     print(f"\nDownload for asset {asset} was bad!")
-                    print("Waiting 5 seconds and retrying.")
-                    time.sleep(5)
+                    part_path.unlink(missing_ok=True)
+                    backoff.wait(response)
                 else:
                     # Success!
-                    break
+                    os.replace(part_path, zip_path)
+                    return checksum.hexdigest()
             except Exception as ex:
+                response.close()
+
+                if isinstance(ex, OSError) and ex.errno == errno.ENOSPC: # Retrying won't help until space is freed up
+                    print(f"\nRan out of free space while downloading asset {asset}, skipping it. What was downloaded so far is kept for next time.")
+                    return None
+
                 print(f"\nError while downloading asset {asset}! Exception was {ex}")
-                print("Waiting 5 seconds and retrying.")
-                time.sleep(5)
+                backoff.wait(response)
 
+    return None
 
-def request_quixel_asset(token, asset, asset_components, asset_path):
-    while True:
+
+def request_download_id(credentials, asset, asset_components):
+    # Asks the servers to package the asset. Returns (download ID, when it was requested), or None if the asset doesn't exist.
+    backoff = quixel_client.Backoff("downloads")
+
+    while not stop_event.is_set():
+        token = credentials.get() # Only waits if the token has expired and there's no new one yet
         headers = {"Authorization": token}
 
         data = {"asset": asset,
@@ -110,7 +197,7 @@ def request_quixel_asset(token, asset, asset_components, asset_path):
                            "albedo_lods": True},
                 "components": asset_components}
 
-        response = requests.post("https://quixel.com/v1/downloads", headers=headers, json=data)
+        response = quixel_client.post("https://quixel.com/v1/downloads", "downloads", request_limiter, headers=headers, json=data)
 
         if response.status_code != 200:
             try:
@@ -120,69 +207,197 @@ def request_quixel_asset(token, asset, asset_components, asset_path):
                 if "code" in json_response:
                     if json_response["code"] == "ASSET_DOES_NOT_EXIST":
                         print(f"\nRequested asset {asset} does not exist! Skipping. (you will continue to recieve this message on each run as long as the asset's metadata is still present, use remove_asset_from_metadata.py to remove it)")
-                        return token, False
+                        return None
                 if "message" in json_response:
                     if json_response["message"] == "Expired token":
-                        token = extract_token(input("Your Quixel token has expired! Please input a refreshed token: "))
+                        credentials.expired(token)
+                        continue # Retried as soon as there's a new token
             except json.JSONDecodeError:
                 print(f"\nError on decode with code {response.status_code}! Here is the response: {response}")
             
-            print("Waiting 5 seconds and retrying.")
-            time.sleep(5)
+            backoff.wait(response)
         else:
             try:
                 json_response = response.json()
-                download_id = json_response["id"]
-                download_quixel_asset(asset, asset_path, download_id)
 
-                return token, True
+                return json_response["id"], time.monotonic()
             except json.JSONDecodeError:
                 print(f"Error on decode! Here is the response: {response}")
-                print("Waiting 5 seconds and retrying.")
-                time.sleep(5)
+                backoff.wait(response)
+
+    return None
+
+
+def download_asset(credentials, asset, asset_components, prefetched, asset_path, bar_positions):
+    bar_position = bar_positions.get() # Each worker gets its own progress bar line
+
+    try:
+        download_id = prefetched.result()
+
+        while download_id is not None and not stop_event.is_set():
+            if time.monotonic() - download_id[1] > download_id_lifetime:
+                print(f"\nThe download ID for asset {asset} is too old to use, requesting a new one.")
+                download_id = request_download_id(credentials, asset, asset_components)
+                continue
+
+            checksum = download_quixel_asset(asset, asset_path, download_id[0], bar_position)
+
+            if checksum is not False:
+                return checksum
+
+            print(f"\nThe download ID for asset {asset} has expired, requesting a new one.")
+            download_id = request_download_id(credentials, asset, asset_components)
+
+        return None
+    finally:
+        bar_positions.put(bar_position)
+
+
+def restore_missing_zips(store, asset_path, checksums):
+    # Downloaded zips that went missing but are still in the content store are put back, the checksum journal already counts them as downloaded
+    restored = 0
+
+    for asset, checksum in checksums.items():
+        if not (asset_path / f"{asset}.zip").exists() and store.restore(checksum, asset_path / f"{asset}.zip"):
+            restored += 1
+
+    if restored:
+        print(f"\nRestored {restored} missing zips from the content store.")
+
+
+def select_assets(asset_path, asset_types, assets_not_downloaded):
+    asset_categories = list(set([asset_types[asset] for asset in assets_not_downloaded if asset in asset_types]))
+
+    while True:
+        selection = input(f"\nWhich one of these asset categories would you like to download? {", ".join(asset_categories)} (or enter a query like category=3d AND tag=rock, see asset_index.py): ").strip()
+
+        if "=" not in selection:
+            return [asset for asset, asset_type in asset_types.items() if asset_type == selection and asset in assets_not_downloaded]
+
+        try:
+            return [asset for asset in asset_index.load_quixel_index(asset_path).query(selection) if asset in assets_not_downloaded]
+        except ValueError as ex:
+            print(f"\n{ex}")
 
 
 def download_all_assets(asset_metadata, asset_path, checksums):
-    token = extract_token(input("Enter your Quixel token (refer to the readme for instructions): "))
+    credentials = quixel_credentials.CredentialProvider("Enter your Quixel token (refer to the readme for instructions): ")
 
-    temp_assets_to_download = list(set(checksums.keys()) ^ set(asset_metadata["asset_metadata"].keys()))
-    asset_categories = list(set([asset["full_metadata"]["semanticTags"]["asset_type"] for asset in asset_metadata["asset_metadata"].values() if asset["full_metadata"]["id"] in temp_assets_to_download]))
+    asset_types = asset_metadata.asset_types() # Only asset IDs and types, so this is quick even with asset_metadata.db
+    temp_assets_to_download = set(asset for asset in set(checksums.keys()) ^ set(asset_types.keys()) if sharding.in_shard(asset))
 
-    print(f"\n{asset_metadata["total"]} total assets in asset metadata.")
+    print(f"\n{asset_metadata.total} total assets in asset metadata.")
     print(f"{len(checksums)} total assets downloaded.")
-    print(f"{len(temp_assets_to_download)} total assets not yet downloaded.")
-    selected_asset_type = input(f"\nWhich one of these asset categories would you like to download? {", ".join(asset_categories)}: ")
+    print(f"{len(temp_assets_to_download)} total assets not yet downloaded{"" if sharding.shard is None else f" in {sharding.describe()}"}.")
 
-    assets_to_download = [asset["full_metadata"]["id"] for asset in asset_metadata["asset_metadata"].values() if asset["full_metadata"]["semanticTags"]["asset_type"] == selected_asset_type and asset["full_metadata"]["id"] in temp_assets_to_download]
+    assets_to_download = select_assets(asset_path, asset_types, temp_assets_to_download)
 
-    print(f"\n{len(assets_to_download)} assets to download.")
-    print("Do NOT quit the program between downloads, as this is likely to destroy your checksum file while the .zip checksum is being saved. It is safe to quit while a file is being downloaded. When you restart the program, it will resume where it left off.")
+    print(f"\nPlanning {len(assets_to_download)} downloads...")
+    plan = download_planner.order_plan(download_planner.plan_downloads(asset_metadata, assets_to_download, asset_path), download_planner.download_order)
+    remaining_size = sum(planned["remaining"] for planned in plan)
+    free_space = shutil.disk_usage(asset_path).free
 
-    for asset in tqdm(assets_to_download):
-        if "components" in asset_metadata["asset_metadata"][asset]["full_metadata"]: # Find all components for this asset, necessary to explicitly request .exr
-            type_list = list(set([component["type"] for component in asset_metadata["asset_metadata"][asset]["full_metadata"]["components"]]))
-        else:
-            type_list = list(set([component["type"] for component in asset_metadata["asset_metadata"][asset]["full_metadata"]["maps"]]))
-        type_list.sort()
-        asset_components = [{"type": image_map, "mimeType": "image/x-exr"} for image_map in type_list]
-        
-        token, asset_result = request_quixel_asset(token, asset, asset_components, asset_path)
-        if asset_result:
-            checksum = calculate_checksum(asset, asset_path)
-            checksums[asset] = checksum
-            save_checksums(checksums, asset_path)
+    print(f"{len(plan)} assets to download in {download_planner.download_order} order, {download_workers} at a time.")
+    print(f"About {download_planner.format_size(remaining_size)} left to download ({sum(not planned["size_known"] for planned in plan)} asset sizes guessed), {download_planner.format_size(free_space)} free.")
+    if remaining_size > free_space - download_planner.minimum_free_space:
+        print(f"That won't all fit! Assets will only be started while at least {download_planner.format_size(download_planner.minimum_free_space)} would stay free.")
+    print("It is safe to quit at any time, checksums are saved as soon as each asset finishes. When you restart the program, it will resume where it left off.")
+
+    bar_positions = queue.Queue()
+    for position in range(1, download_workers + 1):
+        bar_positions.put(position)
+
+    journal = checksum_journal.ChecksumJournal(checksums, asset_path)
+    store = content_store.ContentStore(asset_path) if deduplicate_assets else None
+
+    if store is not None:
+        restore_missing_zips(store, asset_path, checksums)
+
+    executor = ThreadPoolExecutor(max_workers=download_workers)
+    prefetch_executor = ThreadPoolExecutor(max_workers=prefetch_ahead + 1)
+    pending = {}
+    prefetched = {} # Asset ID: future download ID, for the assets about to be started
+    skipped = []
+    progress_bar = tqdm(total=len(plan))
+
+    def handle_finished(finished):
+        # Only this thread touches the checksums and the overall progress bar, workers just hand back their results
+        for future in finished:
+            planned = pending.pop(future)
+            space_reservations.release(planned["asset"])
+            checksum = future.result()
+
+            if checksum is not None:
+                journal.record(planned["asset"], checksum)
+
+                if store is not None:
+                    store.add(asset_path / f"{planned["asset"]}.zip", checksum)
+
+            progress_bar.update(1)
+
+        quixel_metrics.set_gauge("quixel_queue_depth", len(pending), queue="downloads")
+
+    def prefetch(position):
+        # Requests download IDs for the next prefetch_ahead assets after this one, which start packaging while the current downloads run
+        for planned in plan[position:position + prefetch_ahead + 1]:
+            if planned["asset"] not in prefetched:
+                prefetched[planned["asset"]] = prefetch_executor.submit(request_download_id, credentials, planned["asset"], planned["components"])
+
+        quixel_metrics.set_gauge("quixel_queue_depth", sum(not future.done() for future in prefetched.values()), queue="prefetch")
+
+    try:
+        # Downloads are only started once a worker is free, so the order and the free space check apply to each one as it starts
+        for position, planned in enumerate(plan):
+            prefetch(position)
+
+            while pending and (len(pending) >= download_workers or not space_reservations.has_room(asset_path, planned["asset"], planned["remaining"])):
+                handle_finished(wait(pending, return_when=FIRST_COMPLETED).done)
+
+            if not space_reservations.has_room(asset_path, planned["asset"], planned["remaining"]):
+                print(f"\nNot enough free space for asset {planned["asset"]} (about {download_planner.format_size(planned["remaining"])}), skipping it.")
+                prefetched.pop(planned["asset"]).cancel()
+                skipped.append(planned["asset"])
+                progress_bar.update(1)
+                continue
+
+            space_reservations.reserve(planned["asset"], planned["remaining"]) # Until its download knows the real size
+            pending[executor.submit(download_asset, credentials, planned["asset"], planned["components"], prefetched.pop(planned["asset"]), asset_path, bar_positions)] = planned
+            quixel_metrics.set_gauge("quixel_queue_depth", len(pending), queue="downloads")
+
+        while pending:
+            handle_finished(wait(pending, return_when=FIRST_COMPLETED).done)
+    except KeyboardInterrupt:
+        # Workers may be waiting for a new token or a retry, so they're told to stop rather than waited on. Each one notices within a chunk or a request.
+        stop_event.set()
+        credentials.stop()
+        prefetch_executor.shutdown(wait=False, cancel_futures=True)
+        executor.shutdown(wait=False, cancel_futures=True)
+        raise
+    finally:
+        journal.close()
+        progress_bar.close()
+
+    executor.shutdown()
+    prefetch_executor.shutdown()
 
     #save_asset_metadata(asset_metadata, asset_path)
 
-    print(f"\nFinished downloading {len(assets_to_download)} assets!")
+    print(f"\nFinished downloading {len(plan) - len(skipped)} assets!")
+
+    if skipped:
+        print(f"{len(skipped)} assets were skipped for lack of free space. Free up some space and run this again to download them.")
 
+    if store is not None and store.deduplicated:
+        print(f"{store.deduplicated} downloaded zips were identical to ones already stored, saving {download_planner.format_size(store.reclaimed)}.")
+
+
+sharding.read_shard_argument(sys.argv[1:])
 
 asset_path = Path(input("Enter the FULL path of the folder you want to download assets to: "))
 asset_metadata = None
 
 try:
-    with open(asset_path / "asset_metadata.json", "r", encoding="utf-8") as f:
-        asset_metadata = json.load(f)
+    asset_metadata = metadata_store.open_metadata(asset_path)
 except FileNotFoundError:
     print(f"\n\nCouldn't find asset_metadata.json in the directory you selected, {asset_path}")
     print("\nFor a proper archive, this program utilizes an asset_metadata.json file in the same directory as the assets to store SHA256 hashes for each .zip file when downloading is finished.")
@@ -191,10 +406,6 @@ except FileNotFoundError:
     input("Press Enter to exit...")
 
 if asset_metadata:
-    try:
-        with open(asset_path / "checksums.json", "r", encoding="utf-8") as f:
-            checksums = json.load(f)
-    except FileNotFoundError:
-        checksums = {}
+    checksums = checksum_journal.load_checksums(asset_path)
 
     download_all_assets(asset_metadata, asset_path, checksums)
\ No newline at end of file
@@ -1,69 +1,231 @@
-import requests
+import os
+import sys
 import json
-import time
-import random
+import hashlib
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from tqdm import tqdm
+import quixel_client
+import metadata_store
+import quixel_metrics
+import content_store
+import sharding
+import asset_index
 
 
 # This script should be run with a COMPLETE asset_metadata.json file in the directory you wish to download images to. Simply copy it from the directory this script is in.
 # Note that this script is SEPARATE from download_all_assets.py. It only downloads the preview images made available for each asset. (not textures!)
 # If you want a complete archive, be sure to run this script as well. The downloaded .zip files do include a preview image, but Quixel typically provides more than that for each asset.
+# Every finished image is recorded in image_manifest.jsonl along with its size, ETag and SHA-256, so re-runs only fetch images that are missing or incomplete.
+# To split the download between several machines, run it with --shard i/N on each of them (see sharding.py).
 
 
-def download_image_set(uri_list, image_path):
-    for uri in tqdm(uri_list, position=1, leave=False):
-        response = requests.get(f"https://ddinktqu5prvc.cloudfront.net/{uri}", stream=True)
+image_workers = 8 # Most images downloaded at the same time
+requests_per_second = 10 # Requests sent to the image server per second at first, across all workers. quixel_client adjusts it to what the server can handle, unless adaptive_pacing is turned off there.
+revalidate_images = False # Set to True to ask the server whether already downloaded images have changed (using their ETag) instead of skipping them
+image_query = asset_index.get_query(sys.argv[1:]) # Only download images of assets matching this query, like "category=3d AND tag=rock" (see asset_index.py). None downloads every image. Can also be given with --query "...".
+deduplicate_images = False # Set to True to store identical images only once, linking the copies to each other (see content_store.py). Missing images that were stored before are then restored instead of downloaded.
 
-        if response.status_code != 200:
+
+stop_event = quixel_client.stop_event # Set on Ctrl+C so workers stop retrying and exit
+
+
+def load_manifest(image_path):
+    # Returns {uri: {"size": size, "etag": etag, "sha256": sha256}} for every finished image
+    manifest = {}
+
+    try:
+        with open(image_path / "image_manifest.jsonl", "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.endswith("\n"): # Cut off by a crash mid-write, the image will just be checked again
+                    break
+
+                entry = json.loads(line)
+                manifest[entry["uri"]] = {"size": entry["size"], "etag": entry["etag"], "sha256": entry.get("sha256")} # Older manifests don't have hashes
+    except FileNotFoundError:
+        pass
+
+    return manifest
+
+
+def save_manifest_entry(f, uri, entry):
+    f.write(json.dumps({"uri": uri, "size": entry["size"], "etag": entry["etag"], "sha256": entry["sha256"]}, ensure_ascii=False) + "\n")
+    f.flush()
+
+
+def is_downloaded(new_image_path, entry):
+    try:
+        return entry is not None and new_image_path.stat().st_size == entry["size"]
+    except FileNotFoundError:
+        return False
+
+
+def download_image(uri, image_path, entry, rate_limiter):
+    # Returns the manifest entry for the image once it's on disk, and whether it actually had to be downloaded
+    new_image_path = image_path / uri
+    backoff = quixel_client.Backoff("images")
+
+    if is_downloaded(new_image_path, entry) and not (revalidate_images and entry["etag"]):
+        return entry, False
+
+    while not stop_event.is_set():
+        headers = {}
+        if entry is not None and entry["etag"] and is_downloaded(new_image_path, entry): # Conditional GET, the server answers 304 if the image hasn't changed
+            headers["If-None-Match"] = entry["etag"]
+
+        response = quixel_client.get(f"https://ddinktqu5prvc.cloudfront.net/{uri}", "images", rate_limiter, stream=True, headers=headers)
+
+        if response.status_code == 304:
+            response.close()
+            return entry, False
+        elif response.status_code != 200:
             try:
                 json_response = response.json()
                 print(f"\nEncountered error {response.status_code} with image {uri}! Here is the response from the Quixel server: {json_response}")
             except json.JSONDecodeError:
                 print(f"\nEncountered error while downloading image {uri}! (Recieved status code {response.status_code} and response {response} from Quixel server)")
 
-            print("Waiting 5 seconds and retrying.")
-            time.sleep(5)
-        else:
-            new_image_path = image_path / uri
+            backoff.wait(response)
+            continue
+
+        new_entry = {"size": int(response.headers["Content-Length"]) if "Content-Length" in response.headers else None,
+                     "etag": response.headers.get("ETag"),
+                     "sha256": None}
 
-            new_image_path.parent.mkdir(exist_ok=True, parents=True)
+        # An image from before the manifest existed is kept if it's already the right size
+        if entry is None and new_entry["size"] is not None and new_image_path.exists() and new_image_path.stat().st_size == new_entry["size"]:
+            response.close()
+            return new_entry, False
 
-            with open(new_image_path, "wb") as f:
-                for chunk in response.iter_content(chunk_size=(1024*1024)*8):
+        new_image_path.parent.mkdir(exist_ok=True, parents=True)
+        part_path = new_image_path.with_name(new_image_path.name + ".part") # Only moved into place once complete, so a half-written image is never mistaken for a finished one
+
+        checksum = hashlib.sha256()
+
+        try:
+            with open(part_path, "wb") as f:
+                for chunk in quixel_metrics.iter_transfer("images", response.iter_content(chunk_size=1024*1024)):
                     f.write(chunk)
-        
-        time.sleep(round(random.uniform(0.1, 1), 2))
+                    checksum.update(chunk)
+        except Exception as ex:
+            print(f"\nError while downloading image {uri}! Exception was {ex}")
+            backoff.wait(response)
+            continue
+
+        if new_entry["size"] is not None and part_path.stat().st_size != new_entry["size"]:
+            print(f"\nDownload for image {uri} was incomplete!")
+            backoff.wait(response)
+            continue
+
+        new_entry["size"] = part_path.stat().st_size
+        new_entry["sha256"] = checksum.hexdigest()
+        os.replace(part_path, new_image_path)
+
+        return new_entry, True
 
+    return entry, False # Stopped before the image was downloaded
 
-def download_all_images(asset_metadata, image_path, folder_names):
-    asset_images_to_download = sorted(list(set(folder_names) ^ set(asset_metadata["asset_metadata"].keys())))
-    
-    print(f"\n{asset_metadata["total"]} total assets in asset metadata.")
-    print(f"{len(folder_names)} total asset image sets downloaded.")
-    print(f"{len(asset_images_to_download)} total asset image sets not yet downloaded.")
 
-    for asset in tqdm(asset_images_to_download):
-        uri_list = [image["uri"].removeprefix("/quixel-megascans-assets/") for image in asset_metadata["asset_metadata"][asset]["full_metadata"]["previews"]["images"] if image["uri"].endswith(".png")]
+def iter_uris(asset_metadata, selected_assets):
+    for asset, asset_data in asset_metadata.items():
+        if not sharding.in_shard(asset) or (selected_assets is not None and asset not in selected_assets):
+            continue
 
-        download_image_set(uri_list, image_path)
-        
-    print(f"\nFinished downloading {len(asset_images_to_download)} image sets!")
+        for image in asset_data["full_metadata"]["previews"]["images"]:
+            if image["uri"].endswith(".png"):
+                yield image["uri"].removeprefix("/quixel-megascans-assets/")
 
 
+def download_all_images(asset_metadata, image_path):
+    manifest = load_manifest(image_path)
+    selected_assets = set(asset_index.load_quixel_index(image_path).query(image_query)) if image_query else None
+    rate_limiter = quixel_client.AdaptiveLimiter("images", requests_per_second, image_workers)
+    store = content_store.ContentStore(image_path) if deduplicate_images else None
+    download_count = 0
+    restore_count = 0
+    image_count = 0
+
+    print(f"\n{asset_metadata.total} total assets in asset metadata.")
+    if sharding.shard is not None:
+        print(f"Only downloading images of assets in {sharding.describe()}.")
+    if selected_assets is not None:
+        print(f"Only downloading images of the {len(selected_assets)} assets matching {image_query}.")
+    print(f"{len(manifest)} images already downloaded. Only missing or incomplete images will be downloaded, {image_workers} at a time.")
+
+    # Assets are read one at a time as downloading goes, so there's no waiting for the whole metadata file to load
+    with open(image_path / "image_manifest.jsonl", "a", encoding="utf-8") as manifest_file:
+        executor = ThreadPoolExecutor(max_workers=image_workers)
+        pending = {}
+        progress_bar = tqdm(unit=" images")
+
+        def handle_finished(finished):
+            nonlocal download_count
+
+            # Only this thread writes to the manifest
+            for future in finished:
+                uri = pending.pop(future)
+                entry, downloaded = future.result()
+
+                if manifest.get(uri) != entry:
+                    manifest[uri] = entry
+                    save_manifest_entry(manifest_file, uri, entry)
+
+                if store is not None and downloaded and entry["sha256"]:
+                    store.add(image_path / uri, entry["sha256"])
+
+                download_count += downloaded
+                progress_bar.update(1)
+
+            quixel_metrics.set_gauge("quixel_queue_depth", len(pending), queue="images")
+
+        try:
+            for uri in iter_uris(asset_metadata, selected_assets):
+                image_count += 1
+
+                if (is_downloaded(image_path / uri, manifest.get(uri)) and not revalidate_images) or uri in pending.values(): # Some assets share preview images
+                    progress_bar.update(1)
+                    continue
+
+                if store is not None and uri in manifest and manifest[uri]["sha256"] and not (image_path / uri).exists() and store.restore(manifest[uri]["sha256"], image_path / uri):
+                    restore_count += 1
+                    progress_bar.update(1)
+                    continue
+
+                pending[executor.submit(download_image, uri, image_path, manifest.get(uri), rate_limiter)] = uri
+
+                if len(pending) >= image_workers * 4: # Don't queue up more than the workers can get through soon
+                    finished, not_finished = wait(pending, return_when=FIRST_COMPLETED)
+                    handle_finished(finished)
+
+            handle_finished(wait(pending).done)
+        except KeyboardInterrupt:
+            # Workers may be waiting to retry, so they're told to stop rather than waited on. Finished images are already in the manifest.
+            stop_event.set()
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+        finally:
+            progress_bar.close()
+
+        executor.shutdown()
+
+    print(f"\nChecked {image_count} images and downloaded {download_count} of them!")
+
+    if store is not None:
+        print(f"{store.deduplicated} downloaded images were already stored, saving {store.reclaimed / (1024*1024):.1f} MB. {restore_count} missing images were restored from the content store.")
+
+
+sharding.read_shard_argument(sys.argv[1:])
+
 image_path = Path(input("Enter the FULL path of the folder you want to download images to: "))
 asset_metadata = None
 
 try:
-    with open(image_path / "asset_metadata.json", "r", encoding="utf-8") as f:
-        asset_metadata = json.load(f)
+    asset_metadata = metadata_store.open_metadata(image_path, fields=["full_metadata.previews.images"]) # Only the preview images are needed, so asset_metadata.json is streamed instead of loaded
 except FileNotFoundError:
     print(f"\n\nCouldn't find asset_metadata.json in the directory you selected, {image_path}")
     print("\nFor a proper archive, this program utilizes an asset_metadata.json file in the same directory as the image sets to determine where and how to download image sets.")
     print(f"\nSo, to run this program, simply copy your COMPLETE (basic metadata will not work!) asset_metadata.json file (made using get_all_complete_asset_metadata.py) to {image_path}\n")
     input("Press Enter to exit...")
 
-folder_names = sorted([folder.name for folder in image_path.iterdir() if folder.is_dir()])
-
 if asset_metadata:
-    download_all_images(asset_metadata, image_path, folder_names)
\ No newline at end of file
+    download_all_images(asset_metadata, image_path)
@@ -0,0 +1,126 @@
+import shutil
+import statistics
+import threading
+import disk_writer
+
+
+# Works out what download_all_assets.py downloads and in which order. Not meant to be run on its own.
+# Every pending asset's components and expected size are read from its metadata once, before any downloading starts.
+# Sizes come from the .exr files listed under "components" (their "size" or "contentLength") or from "maps" ("contentLength"). Assets without any are assumed to be the median size of the rest.
+
+
+download_order = "interleaved" # "largest" first, "smallest" first, "interleaved" (alternating largest and smallest, so workers get an even mix) or "metadata" (the order in asset_metadata.json)
+minimum_free_space = (1024*1024*1024)*5 # Bytes always left free on the download drive. An asset is only started if it fits, counting the downloads already in progress.
+default_asset_size = (1024*1024)*500 # Assumed size of every asset when none of them have size info
+
+
+def get_asset_components(full_metadata):
+    if "components" in full_metadata: # Find all components for this asset, necessary to explicitly request .exr
+        type_list = list(set([component["type"] for component in full_metadata["components"]]))
+    else:
+        type_list = list(set([component["type"] for component in full_metadata["maps"]]))
+    type_list.sort()
+
+    return [{"type": image_map, "mimeType": "image/x-exr"} for image_map in type_list]
+
+
+def get_file_size(file_info):
+    return file_info.get("size", file_info.get("contentLength"))
+
+
+def estimate_asset_size(full_metadata):
+    # The largest .exr of each component type (what gets requested), falling back to the largest file of any format. Returns None without size info.
+    exr_sizes = {}
+    any_sizes = {}
+
+    def add_size(component_type, mime_type, size):
+        if not isinstance(size, (int, float)):
+            return
+
+        any_sizes[component_type] = max(any_sizes.get(component_type, 0), size)
+        if mime_type == "image/x-exr":
+            exr_sizes[component_type] = max(exr_sizes.get(component_type, 0), size)
+
+    for component in full_metadata.get("components", []):
+        for uri in component.get("uris", []):
+            for resolution in uri.get("resolutions", []):
+                for file_format in resolution.get("formats", []):
+                    add_size(component["type"], file_format.get("mimeType"), get_file_size(file_format))
+
+    for image_map in full_metadata.get("maps", []):
+        add_size(image_map["type"], image_map.get("mimeType"), get_file_size(image_map))
+
+    if not any_sizes:
+        return None
+
+    return int(sum(exr_sizes.get(component_type, size) for component_type, size in any_sizes.items()))
+
+
+def plan_downloads(asset_metadata, assets, asset_path):
+    # Returns [{"asset": asset ID, "components": [...], "size": expected zip size, "remaining": bytes still to download}, ...] in metadata order
+    plan = []
+
+    for asset in assets:
+        full_metadata = asset_metadata.get(asset)["full_metadata"]
+        plan.append({"asset": asset, "components": get_asset_components(full_metadata), "size": estimate_asset_size(full_metadata)})
+
+    known_sizes = [planned["size"] for planned in plan if planned["size"] is not None]
+    assumed_size = int(statistics.median(known_sizes)) if known_sizes else default_asset_size
+
+    for planned in plan:
+        planned["size_known"] = planned["size"] is not None
+        if planned["size"] is None:
+            planned["size"] = assumed_size
+
+        part_path = asset_path / f"{planned["asset"]}.zip.part" # Resumed downloads only need the rest
+        planned["remaining"] = max(planned["size"] - disk_writer.written_length(part_path), 0)
+
+    return plan
+
+
+def order_plan(plan, order):
+    if order == "metadata":
+        return list(plan)
+
+    by_size = sorted(plan, key=lambda planned: planned["size"], reverse=True)
+
+    if order == "largest":
+        return by_size
+    elif order == "smallest":
+        return by_size[::-1]
+    elif order == "interleaved":
+        # Largest, smallest, second largest, second smallest, ... picked by position rather than popping from the front, which is slow on big plans
+        return [by_size[position // 2] if position % 2 == 0 else by_size[-1 - position // 2] for position in range(len(by_size))]
+    else:
+        raise ValueError(f"Unknown download order {order!r}, should be \"largest\", \"smallest\", \"interleaved\" or \"metadata\"")
+
+
+class SpaceReservations:
+    # Space that downloads in progress may still write, by asset ID. A download's reservation is dropped once its .part file has been preallocated, from then on the drive's free space already leaves it out.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reserved = {}
+
+    def reserve(self, asset, size):
+        with self.lock:
+            self.reserved[asset] = size
+
+    def release(self, asset):
+        with self.lock:
+            self.reserved.pop(asset, None)
+
+    def has_room(self, asset_path, asset, needed):
+        # Whether asset can still write needed bytes, counting every other download's reservation but not its own
+        with self.lock:
+            reserved = sum(size for other, size in self.reserved.items() if other != asset)
+
+        return shutil.disk_usage(asset_path).free - reserved - needed >= minimum_free_space
+
+
+def format_size(size):
+    for unit in ["B", "KB", "MB", "GB"]:
+        if size < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+
+    return f"{size:.1f} TB"
@@ -1,68 +1,108 @@
-import requests
+import sys
 import json
-import time
-import random
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from tqdm import tqdm
+import quixel_client
+import quixel_metrics
+import asset_listing
+import metadata_files
+import metadata_journal
+import sharding
 
 
 # This script should be run after get_all_basic_asset_metadata.py. It requires an instantiated asset_metadata.json file with all asset IDs.
 # Once done, you should run claim_all_assets.py if you intend on downloading all files. Quixel will refuse file download requests without proper ownership.
 # After you've claimed all assets and downloaded full metadata for each asset, you may finally proceed to run download_all_assets.py.
+# Every response is saved to asset_metadata.journal.jsonl as soon as it arrives, so if this script is interrupted, just run it again and it will continue where it left off.
+# To split the crawl between several machines, run it with --shard i/N on each of them (see sharding.py). Each machine then keeps its journal instead of merging it, and merge_shards.py combines the journals.
 
 
-def query_quixel_asset(asset):
-    while True:
-        response = requests.get(f"https://quixel.com/v1/assets/{asset}")
+complete_workers = 4 # Most assets requested at the same time
+requests_per_second = 2 # Requests sent to the Quixel servers per second at first, across all workers. quixel_client adjusts it to what the servers can handle, unless adaptive_pacing is turned off there.
 
-        if response.status_code != 200:
-            print(f"\nEncountered error with asset {asset}! (Recieved status code {response.status_code} from Quixel server)")
-            print("Waiting 5 seconds and retrying.")
-            time.sleep(5)
-        else:
-            try:
-                json_response = response.json()
 
-                return json_response
-            except json.JSONDecodeError:
-                print(f"Error on decode! Here is the response: {response}")
-                print("Waiting 5 seconds and retrying.")
-                time.sleep(5)
+metadata_path = metadata_files.find_metadata(Path(".")) # asset_metadata.json, or a compressed copy of it
+journal_path = Path("asset_metadata.journal.jsonl")
+rate_limiter = quixel_client.AdaptiveLimiter("asset", requests_per_second, complete_workers)
 
 
 def get_metadata(asset_metadata):
-    print(f"{asset_metadata["total"]} total assets in asset metadata. Beginning download.")
-    print("There is an artificial, random delay of between 0.1 and 1 second between each request to reduce load on the Quixel servers, so expect to wait several hours.\n")
+    journaled = metadata_journal.load_journal(journal_path)
+    shard_assets = [asset_id for asset_id in asset_metadata["asset_metadata"] if sharding.in_shard(asset_id)]
+    assets_to_query = [asset_id for asset_id in shard_assets if asset_id not in journaled and "full_metadata" not in asset_metadata["asset_metadata"][asset_id]]
 
+    print(f"{asset_metadata["total"]} total assets in asset metadata.")
+    if sharding.shard is not None:
+        print(f"{len(shard_assets)} of them are in {sharding.describe()}.")
+    print(f"{len(shard_assets) - len(assets_to_query)} assets already have complete metadata. Beginning download of the other {len(assets_to_query)}.")
+    print(f"Assets are requested up to {complete_workers} at a time, starting at {requests_per_second} requests per second and adjusting to what the Quixel servers can handle, so expect to wait a while.\n")
 
-    for asset_id in tqdm(asset_metadata["asset_metadata"].keys()):
-        response = query_quixel_asset(asset_id)
 
-        if response != {}:
-            asset_metadata["asset_metadata"][asset_id]["full_metadata"] = response
-            time.sleep(round(random.uniform(0.1, 1), 2))
-        else:
-            print(f"\nSomething pretty weird has happened. If you are seeing this message, then Quixel probably messed something up with asset {asset_id}. Let me know on Github!")
-            input("Press enter to proceed once you have read this message.")
+    with open(journal_path, "ab") as journal:
+        executor = ThreadPoolExecutor(max_workers=complete_workers)
+        pending = {}
+        progress_bar = tqdm(total=len(assets_to_query))
 
+        def handle_finished(finished):
+            # Only this thread writes to the journal
+            for future in finished:
+                asset_id = pending.pop(future)
+                response = future.result()
+
+                if response != {}:
+                    metadata_journal.append_entry(journal, asset_id, response)
+                else:
+                    print(f"\nSomething pretty weird has happened. If you are seeing this message, then Quixel probably messed something up with asset {asset_id}. Let me know on Github!")
+                    input("Press enter to proceed once you have read this message.")
+
+                progress_bar.update(1)
+
+            quixel_metrics.set_gauge("quixel_queue_depth", len(pending), queue="assets")
+
+        try:
+            for asset_id in assets_to_query:
+                pending[executor.submit(asset_listing.query_quixel_asset, asset_id, rate_limiter)] = asset_id
+
+                if len(pending) >= complete_workers * 4: # Don't queue up more than the workers can get through soon
+                    handle_finished(wait(pending, return_when=FIRST_COMPLETED).done)
+
+            handle_finished(wait(pending).done)
+        except KeyboardInterrupt:
+            # Workers may be waiting to retry, so they're told to stop rather than waited on. What's in the journal is kept for the next run.
+            quixel_client.stop_event.set()
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+        finally:
+            progress_bar.close()
+
+        executor.shutdown()
+
+
+    if sharding.shard is not None:
+        print(f"\nComplete asset metadata downloaded for the {len(shard_assets)} assets in {sharding.describe()}!")
+        print(f"It's kept in {journal_path}. Once every shard is done, combine them with merge_shards.py.")
+        return
 
     print(f"\nComplete asset metadata downloaded for {asset_metadata["total"]} assets!")
-    print("Saving to asset_metadata.json... (this will take a while and produce a huge file!)")
+    print(f"Merging into {metadata_files.output_path(metadata_path)}... (this will produce a huge file!)")
 
 
-    with open("asset_metadata.json", "w", encoding="utf-8") as f:
-        json.dump(asset_metadata, f, ensure_ascii=False, indent=4)
+    metadata_journal.compact_journal(asset_metadata, metadata_files.output_path(metadata_path), journal_path)
 
 
     print("\nSaved! If you want to download all files, then make sure to run claim_all_assets.py first to add all assets to your account! Quixel will refuse file download requests without proper ownership.")
     print("Once you've done that, you can run download_all_assets.py.")
 
 
+sharding.read_shard_argument(sys.argv[1:])
+
 asset_metadata = None
 
-try:
-    with open("asset_metadata.json", "r", encoding="utf-8") as f:
+if metadata_path is not None:
+    with metadata_files.open_read(metadata_path) as f:
         asset_metadata = json.load(f)
-except FileNotFoundError:
+else:
     print("Couldn't find asset_metadata.json! Have you run get_all_basic_asset_metadata.py yet?\n")
     input("Press Enter to exit...")
 
@@ -0,0 +1,164 @@
+import json
+import hashlib
+from pathlib import Path
+import sharding
+import metadata_files
+import metadata_store
+import metadata_journal
+import checksum_journal
+import compact_metadata
+
+
+# Combines the results of a download split between machines with --shard i/N (see sharding.py) into one folder.
+# Give it the folder to merge into, which needs asset_metadata.json (basic or complete), and the folders each machine worked in.
+# Checksums go into checksums.json, bad assets into bad_assets.txt and journaled metadata into asset_metadata.json. The zips and images themselves aren't copied, move those over however suits you.
+# Assets that no machine finished are listed in shard_gaps.txt by shard, so you know which machine to run again. Assets that two machines disagree about are listed in shard_conflicts.txt, and the first folder's version is kept.
+
+
+def read_lines(file_path):
+    # Complete lines only, a machine may still be writing to its files
+    try:
+        with open(file_path, "rb") as f:
+            return [line for line in f if line.endswith(b"\n")]
+    except FileNotFoundError:
+        return []
+
+
+def read_bad_assets(folder):
+    try:
+        with open(folder / "bad_assets.txt", "r", encoding="utf-8") as f:
+            return set(line.strip() for line in f if line.strip())
+    except FileNotFoundError:
+        return set()
+
+
+def metadata_hash(full_metadata):
+    return hashlib.sha256(json.dumps(full_metadata, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def merge_checksums(output_path, node_paths, conflicts):
+    checksums = checksum_journal.load_checksums(output_path)
+    sources = {asset: output_path for asset in checksums}
+
+    for node_path in node_paths:
+        for asset, checksum in checksum_journal.load_checksums(node_path).items():
+            if asset not in checksums:
+                checksums[asset] = checksum
+                sources[asset] = node_path
+            elif checksums[asset] != checksum:
+                conflicts.append(f"{asset} checksum {sources[asset]} {checksums[asset]} {node_path} {checksum}")
+
+    return checksums
+
+
+def merge_bad_assets(output_path, node_paths, checksums, conflicts):
+    bad_assets = read_bad_assets(output_path)
+
+    for node_path in node_paths:
+        bad_assets |= read_bad_assets(node_path)
+
+    for asset in sorted(bad_assets & checksums.keys()): # Bad on one machine but fine on another, so there's a good copy somewhere
+        conflicts.append(f"{asset} bad_and_good")
+        bad_assets.discard(asset)
+
+    return bad_assets
+
+
+def merge_journals(output_path, node_paths, conflicts):
+    # Appends every node's journaled metadata to the output journal, skipping assets it already has. Returns {asset ID: asset type} for all journaled assets.
+    journal_path = output_path / "asset_metadata.journal.jsonl"
+    hashes = {}
+    sources = {}
+    asset_types = {}
+
+    with open(journal_path, "ab+") as journal:
+        for asset_id, offset in metadata_journal.load_journal(journal_path).items():
+            entry = metadata_journal.read_entry(journal, offset)
+            hashes[asset_id] = metadata_hash(entry["full_metadata"])
+            sources[asset_id] = output_path
+            asset_types[asset_id] = metadata_store.get_asset_type(entry)
+
+        journal.seek(0, 2)
+
+        for node_path in node_paths:
+            for line in read_lines(node_path / "asset_metadata.journal.jsonl"):
+                entry = json.loads(line)
+                entry_hash = metadata_hash(entry["full_metadata"])
+
+                if entry["id"] not in hashes:
+                    journal.write(line)
+                    hashes[entry["id"]] = entry_hash
+                    sources[entry["id"]] = node_path
+                    asset_types[entry["id"]] = metadata_store.get_asset_type(entry)
+                elif hashes[entry["id"]] != entry_hash:
+                    conflicts.append(f"{entry["id"]} metadata {sources[entry["id"]]} {node_path}")
+
+    return asset_types
+
+
+def merge_shards(output_path, node_paths, shard_count):
+    metadata_path = metadata_files.find_metadata(output_path)
+    conflicts = []
+
+    print("\nMerging checksums...")
+    checksums = merge_checksums(output_path, node_paths, conflicts)
+    checksum_journal.write_checksums(dict(sorted(checksums.items())), output_path)
+
+    bad_assets = merge_bad_assets(output_path, node_paths, checksums, conflicts)
+    if bad_assets:
+        with open(output_path / "bad_assets.txt", "w", encoding="utf-8") as f:
+            f.write("\n".join(sorted(bad_assets)))
+
+    print("Merging metadata journals...")
+    journaled = merge_journals(output_path, node_paths, conflicts)
+    asset_metadata = compact_metadata.load_compact(metadata_path)
+    assets = asset_metadata["asset_metadata"]
+
+    def asset_type(asset_id):
+        return journaled[asset_id] if asset_id in journaled else metadata_store.get_asset_type(assets[asset_id])
+
+    # Only what the machines were asked to do counts as a gap: metadata for every asset, and a zip for every asset in a category someone downloaded
+    downloaded_types = set(asset_type(asset_id) for asset_id in checksums if asset_id in assets) - {None}
+    gaps = []
+
+    for asset_id, asset in assets.items():
+        if asset_id not in journaled and "full_metadata" not in asset:
+            gaps.append((asset_id, "metadata"))
+        elif asset_id not in checksums and asset_id not in bad_assets and asset_type(asset_id) in downloaded_types:
+            gaps.append((asset_id, "download"))
+
+    if journaled:
+        print(f"Saving {len(journaled)} journaled assets to {metadata_files.output_path(metadata_path).name}... (this can take a while)")
+        metadata_journal.compact_journal(asset_metadata, metadata_files.output_path(metadata_path), output_path / "asset_metadata.journal.jsonl")
+
+    with open(output_path / "shard_gaps.txt", "w", encoding="utf-8") as f:
+        f.write("".join(f"{asset_id} {kind} {sharding.shard_of(asset_id, shard_count) if shard_count else "-"}\n" for asset_id, kind in gaps))
+
+    with open(output_path / "shard_conflicts.txt", "w", encoding="utf-8") as f:
+        f.write("".join(f"{conflict}\n" for conflict in conflicts))
+
+    print(f"\nMerged {len(checksums)} checksums, {len(bad_assets)} bad assets and {len(journaled)} journaled assets from {len(node_paths)} folders.")
+
+    if shard_count:
+        for index in range(1, shard_count + 1):
+            shard_gaps = [kind for asset_id, kind in gaps if sharding.shard_of(asset_id, shard_count) == index]
+            if shard_gaps:
+                print(f"Shard {index}/{shard_count} is missing metadata for {shard_gaps.count("metadata")} assets and {shard_gaps.count("download")} downloads.")
+
+    print(f"{len(gaps)} gaps saved to shard_gaps.txt, {len(conflicts)} conflicts saved to shard_conflicts.txt.")
+
+
+output_path = Path(input("Enter the FULL path of the folder to merge into (it needs asset_metadata.json): "))
+node_paths = []
+
+print("\nEnter the FULL path of each machine's folder, one at a time. Leave it empty when you're done.")
+while node_path := input(f"Folder {len(node_paths) + 1}: ").strip():
+    if Path(node_path).resolve() != output_path.resolve():
+        node_paths.append(Path(node_path))
+
+shard_count = input("\nHow many shards was the work split into? (leave empty if you don't know): ").strip()
+
+if metadata_files.find_metadata(output_path) is None:
+    print(f"\nCouldn't find asset_metadata.json in the directory you selected, {output_path}")
+else:
+    merge_shards(output_path, node_paths, int(shard_count) if shard_count else None)
@@ -0,0 +1,149 @@
+import io
+import os
+import json
+import tarfile
+import subprocess
+from pathlib import Path
+from contextlib import contextmanager
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# Opens asset metadata whether it's plain (asset_metadata.json), compressed (asset_metadata.json.zst) or inside a .tar.zst like the ones in this repository. Not meant to be run on its own.
+# Compressed metadata is decompressed while it's read and compressed while it's written, so the uncompressed JSON never has to be on disk.
+# Uses the zstandard package (pip install zstandard) if it's installed, otherwise the zstd command line tool.
+
+
+pretty_json = False # Set to True to write metadata indented by 4 spaces like older versions of these scripts. It's easier to read, but bigger and slower to write.
+new_metadata_name = "asset_metadata.json" # Name of newly created metadata files. Set to "asset_metadata.json.zst" to save them compressed.
+compression_level = 3 # zstd level used when writing .json.zst, from 1 (fastest) to 19 (smallest)
+metadata_names = ["asset_metadata.json", "asset_metadata.json.zst", "asset_metadata.tar.zst"] # Looked for in this order
+
+
+class StreamedMember(io.RawIOBase):
+    # A member of a streamed tar can only be read front to back, but asks the tar (which can't answer) whether it's seekable. This just answers no.
+
+    def __init__(self, member_file):
+        self.member_file = member_file
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.member_file.read(len(buffer))
+        buffer[:len(data)] = data
+
+        return len(data)
+
+
+def find_metadata(folder):
+    # Returns the path of the metadata file in folder, or None if there isn't one
+    for name in metadata_names:
+        if (folder / name).exists():
+            return folder / name
+
+    return None
+
+
+def output_path(metadata_path):
+    # Where changes to metadata_path are saved. .tar.zst files are only read, so their changes go to a .json.zst next to them.
+    if metadata_path.name.endswith(".tar.zst"):
+        return metadata_path.with_name(metadata_path.name.removesuffix(".tar.zst") + ".json.zst")
+
+    return metadata_path
+
+
+def metadata_indent():
+    return 4 if pretty_json else None
+
+
+def dump(value, f):
+    if pretty_json:
+        json.dump(value, f, ensure_ascii=False, indent=4)
+    else:
+        json.dump(value, f, ensure_ascii=False, separators=(",", ":"))
+
+
+@contextmanager
+def open_decompressed(path):
+    if zstandard is not None:
+        with open(path, "rb") as f, zstandard.ZstdDecompressor().stream_reader(f) as reader:
+            yield io.BufferedReader(reader, buffer_size=1024*1024)
+    else:
+        process = subprocess.Popen(["zstd", "-dcq", str(path)], stdout=subprocess.PIPE)
+
+        try:
+            yield process.stdout
+        finally:
+            process.stdout.close()
+            process.kill() # Readers like read_header stop early, there's no need to decompress the rest
+            process.wait()
+
+
+@contextmanager
+def open_read(path):
+    # Yields a text file with the metadata JSON, wherever it's stored
+    path = Path(path)
+
+    if not path.name.endswith(".zst"):
+        with open(path, "r", encoding="utf-8") as f:
+            yield f
+        return
+
+    with open_decompressed(path) as raw:
+        if not path.name.endswith(".tar.zst"):
+            yield io.TextIOWrapper(raw, encoding="utf-8")
+            return
+
+        with tarfile.open(fileobj=raw, mode="r|") as tar: # Streamed, the tar is only read front to back
+            for member in tar:
+                if member.isfile() and member.name.endswith(".json"):
+                    yield io.TextIOWrapper(io.BufferedReader(StreamedMember(tar.extractfile(member)), buffer_size=1024*1024), encoding="utf-8")
+                    return
+
+    raise FileNotFoundError(f"There's no .json file in {path}")
+
+
+@contextmanager
+def open_write(path):
+    # Yields a text file to write metadata JSON to. It's written next to path first and only replaces path once complete, so an interrupted write never leaves a broken file.
+    path = Path(path)
+    temp_path = path.with_name(path.name + ".tmp")
+
+    if path.name.endswith(".tar.zst"):
+        raise ValueError(f"Can't write {path}, only .json and .json.zst files can be written")
+
+    try:
+        with open(temp_path, "wb") as raw:
+            process = None
+
+            if not path.name.endswith(".zst"):
+                f = io.TextIOWrapper(raw, encoding="utf-8")
+            elif zstandard is not None:
+                f = io.TextIOWrapper(zstandard.ZstdCompressor(level=compression_level, threads=-1).stream_writer(raw, closefd=False), encoding="utf-8")
+            else:
+                process = subprocess.Popen(["zstd", "-q", f"-{compression_level}", "-T0", "-c"], stdin=subprocess.PIPE, stdout=raw)
+                f = io.TextIOWrapper(process.stdin, encoding="utf-8")
+
+            try:
+                yield f
+            finally:
+                if f.buffer is raw: # Plain JSON, raw is still needed below
+                    f.flush()
+                    f.detach()
+                else:
+                    f.close() # Ends the zstd frame, or lets the zstd process finish
+
+            if process is not None and process.wait() != 0:
+                raise OSError(f"zstd failed while compressing {path}")
+
+            raw.flush()
+            os.fsync(raw.fileno())
+    except BaseException:
+        temp_path.unlink(missing_ok=True)
+        raise
+
+    os.replace(temp_path, path)
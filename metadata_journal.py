@@ -0,0 +1,73 @@
+import os
+import json
+import metadata_files
+import metadata_store
+
+
+# Append-only journal of full asset metadata, so a crawl can be resumed after a crash or Ctrl+C. Not meant to be run on its own.
+# Each line of the journal is one JSON object: {"id": asset ID, "full_metadata": response from the Quixel server}.
+# compact_journal merges the journal into the metadata file, reading one asset at a time.
+
+
+def load_journal(journal_path):
+    # Returns {asset ID: byte offset of its line} for every complete line. A half-written last line (from a crash) is cut off so new lines don't get appended to it.
+    offsets = {}
+    good_length = 0
+
+    try:
+        with open(journal_path, "rb") as f:
+            while line := f.readline():
+                try:
+                    entry = json.loads(line)
+                except (json.JSONDecodeError, UnicodeDecodeError):
+                    break
+
+                if not line.endswith(b"\n"):
+                    break
+
+                offsets[entry["id"]] = good_length
+                good_length += len(line)
+    except FileNotFoundError:
+        return offsets
+
+    if good_length != journal_path.stat().st_size:
+        print(f"\nThe last entry of {journal_path.name} was incomplete, removing it.")
+        os.truncate(journal_path, good_length)
+
+    return offsets
+
+
+def append_entry(f, asset_id, full_metadata):
+    # f should be opened in binary append mode. Each entry is synced to disk before returning, so it survives a crash.
+    f.write(json.dumps({"id": asset_id, "full_metadata": full_metadata}, ensure_ascii=False).encode("utf-8") + b"\n")
+    f.flush()
+    os.fsync(f.fileno())
+
+
+def read_entry(f, offset):
+    f.seek(offset)
+
+    return json.loads(f.readline())
+
+
+def compact_journal(asset_metadata, metadata_path, journal_path):
+    # Writes asset_metadata plus every journaled full_metadata to metadata_path, then removes the journal
+    offsets = load_journal(journal_path)
+
+    def merged_assets(journal):
+        for asset_id, asset in asset_metadata["asset_metadata"].items():
+            if asset_id in offsets:
+                asset = dict(asset)
+                asset["full_metadata"] = read_entry(journal, offsets[asset_id])["full_metadata"]
+
+            yield asset_id, asset
+
+    header = {key: value for key, value in asset_metadata.items() if key != "asset_metadata"}
+
+    # The old file is only replaced once the new one is completely written
+    with open(journal_path, "rb") as journal, metadata_files.open_write(metadata_path) as f:
+        metadata_store.write_asset_metadata(f, header, merged_assets(journal), metadata_files.metadata_indent())
+
+    journal_path.unlink()
+
+    return len(offsets)
@@ -0,0 +1,240 @@
+import os
+import json
+import sqlite3
+import metadata_stream
+import metadata_files
+import compact_metadata
+
+
+# Lets scripts read asset metadata from either asset_metadata.json (or a compressed copy, see metadata_files) or an indexed SQLite copy of it, asset_metadata.db. Not meant to be run on its own.
+# Loading the complete asset_metadata.json takes minutes and several GB of RAM, while asset_metadata.db only loads the assets a script actually asks for.
+# Use convert_asset_metadata.py to create asset_metadata.db from asset_metadata.json and back. The database has indexes on asset type, category and revision date, so assets can be looked up by those without reading every row.
+# Scripts that only need a few fields of each asset can stream asset_metadata.json instead of loading it, see StreamingMetadata.
+
+
+compact_in_memory = True # Keep a fully loaded asset_metadata.json in compact_metadata's records instead of plain dicts, which takes a fraction of the RAM
+
+
+def get_asset_type(asset):
+    return asset.get("full_metadata", {}).get("semanticTags", {}).get("asset_type")
+
+
+def get_categories(asset):
+    return asset.get("full_metadata", {}).get("categories", [])
+
+
+class JsonMetadata:
+    # Wraps a fully loaded asset_metadata.json
+
+    def __init__(self, asset_metadata):
+        self.asset_metadata = asset_metadata
+
+    @property
+    def total(self):
+        return self.asset_metadata["total"]
+
+    def header(self):
+        return {key: value for key, value in self.asset_metadata.items() if key != "asset_metadata"}
+
+    def ids(self):
+        return list(self.asset_metadata["asset_metadata"].keys())
+
+    def asset_types(self):
+        return {asset_id: get_asset_type(asset) for asset_id, asset in self.asset_metadata["asset_metadata"].items()}
+
+    def get(self, asset_id):
+        return self.asset_metadata["asset_metadata"][asset_id]
+
+    def items(self):
+        return iter(self.asset_metadata["asset_metadata"].items())
+
+    def close(self):
+        pass
+
+
+class StreamingMetadata:
+    # Reads asset_metadata.json one asset at a time, keeping only the given dotted field paths of each asset. There is no random access, so get() isn't supported.
+
+    def __init__(self, metadata_path, fields):
+        self.metadata_path = metadata_path
+        self.fields = fields
+        self.cached_header = None
+
+    @property
+    def total(self):
+        return self.header()["total"]
+
+    def header(self):
+        if self.cached_header is None:
+            self.cached_header = metadata_stream.read_header(self.metadata_path)
+
+        return self.cached_header
+
+    def ids(self):
+        return (asset_id for asset_id, asset in metadata_stream.iter_assets(self.metadata_path, []))
+
+    def items(self):
+        return metadata_stream.iter_assets(self.metadata_path, self.fields)
+
+    def close(self):
+        pass
+
+
+class SqliteMetadata:
+    # Reads asset_metadata.db, only parsing the assets that are asked for
+
+    def __init__(self, db_path):
+        self.connection = sqlite3.connect(db_path)
+
+    @property
+    def total(self):
+        return self.header()["total"]
+
+    def header(self):
+        return {key: json.loads(value) for key, value in self.connection.execute("SELECT key, value FROM header ORDER BY position")}
+
+    def ids(self):
+        return [row[0] for row in self.connection.execute("SELECT id FROM assets ORDER BY position")]
+
+    def asset_types(self):
+        return dict(self.connection.execute("SELECT id, asset_type FROM assets ORDER BY position"))
+
+    def ids_by_asset_type(self, asset_type):
+        return [row[0] for row in self.connection.execute("SELECT id FROM assets WHERE asset_type = ? ORDER BY position", (asset_type,))]
+
+    def ids_by_category(self, category):
+        return [row[0] for row in self.connection.execute("SELECT id FROM asset_categories WHERE category = ? ORDER BY id", (category,))]
+
+    def ids_revised_since(self, revised):
+        # revised is compared as text, which orders the ISO 8601 dates Quixel uses correctly
+        return [row[0] for row in self.connection.execute("SELECT id FROM assets WHERE revised > ? ORDER BY revised", (revised,))]
+
+    def get(self, asset_id):
+        row = self.connection.execute("SELECT data FROM assets WHERE id = ?", (asset_id,)).fetchone()
+
+        if row is None:
+            raise KeyError(asset_id)
+
+        return json.loads(row[0])
+
+    def items(self):
+        for asset_id, data in self.connection.execute("SELECT id, data FROM assets ORDER BY position"):
+            yield asset_id, json.loads(data)
+
+    def close(self):
+        self.connection.close()
+
+
+def create_store(db_path, header, assets):
+    # assets is an iterable of (asset ID, asset) pairs, in the order they should be exported in
+    connection = sqlite3.connect(db_path)
+
+    with connection:
+        connection.executescript("""
+            DROP TABLE IF EXISTS header;
+            DROP TABLE IF EXISTS assets;
+            DROP TABLE IF EXISTS asset_categories;
+            CREATE TABLE header (key TEXT PRIMARY KEY, position INTEGER, value TEXT);
+            CREATE TABLE assets (id TEXT PRIMARY KEY, position INTEGER, name TEXT, asset_type TEXT, revised TEXT, data TEXT);
+            CREATE TABLE asset_categories (id TEXT, category TEXT);
+        """)
+
+        connection.executemany("INSERT INTO header VALUES (?, ?, ?)", [(key, position, json.dumps(value, ensure_ascii=False)) for position, (key, value) in enumerate(header.items())])
+
+        for position, (asset_id, asset) in enumerate(assets):
+            full_metadata = asset.get("full_metadata", {})
+
+            connection.execute("INSERT INTO assets VALUES (?, ?, ?, ?, ?, ?)", (asset_id, position, asset.get("name"), get_asset_type(asset), full_metadata.get("revised"), json.dumps(asset, ensure_ascii=False, default=compact_metadata.json_default)))
+            connection.executemany("INSERT INTO asset_categories VALUES (?, ?)", [(asset_id, category) for category in get_categories(asset)])
+
+        # Indexes are built after inserting everything, which is a lot faster than keeping them updated on every insert
+        connection.executescript("""
+            CREATE INDEX assets_asset_type ON assets (asset_type);
+            CREATE INDEX assets_revised ON assets (revised);
+            CREATE INDEX asset_categories_category ON asset_categories (category);
+            CREATE INDEX asset_categories_id ON asset_categories (id);
+        """)
+
+    connection.close()
+
+
+def import_json(json_path, db_path):
+    with metadata_files.open_read(json_path) as f:
+        asset_metadata = json.load(f)
+
+    metadata = JsonMetadata(asset_metadata)
+    create_store(db_path, metadata.header(), metadata.items())
+
+    return len(asset_metadata["asset_metadata"])
+
+
+def write_asset_metadata(f, header, assets, indent=4):
+    # Writes the same output as json.dump(..., indent=indent) would, one asset at a time so the whole file never has to be in memory. With indent=None, the output has no whitespace at all.
+    if indent is None:
+        def dump(value, level):
+            return json.dumps(value, ensure_ascii=False, separators=(",", ":"), default=compact_metadata.json_default)
+
+        newline = pad = separator = ""
+    else:
+        def dump(value, level):
+            return json.dumps(value, ensure_ascii=False, indent=indent, default=compact_metadata.json_default).replace("\n", "\n" + pad * level)
+
+        newline = "\n"
+        pad = " " * indent
+        separator = " "
+
+    f.write("{")
+
+    for key, value in header.items():
+        f.write(f"{newline}{pad}{dump(key, 1)}:{separator}{dump(value, 1)},")
+
+    f.write(f"{newline}{pad}\"asset_metadata\":{separator}{{")
+
+    count = 0
+    for asset_id, asset in assets:
+        f.write(f"{"," if count > 0 else ""}{newline}{pad * 2}{dump(asset_id, 2)}:{separator}{dump(asset, 2)}")
+        count += 1
+
+    f.write(f"{newline}{pad}}}{newline}}}" if count > 0 else "}" + newline + "}")
+
+    return count
+
+
+def export_json(db_path, json_path):
+    metadata = SqliteMetadata(db_path)
+
+    with metadata_files.open_write(json_path) as f:
+        count = write_asset_metadata(f, metadata.header(), metadata.items(), metadata_files.metadata_indent())
+
+    metadata.close()
+
+    # Both now hold the same metadata, so the database shouldn't look out of date next to the new JSON
+    json_time = json_path.stat().st_mtime
+    os.utime(db_path, (json_time, json_time))
+
+    return count
+
+
+def open_metadata(folder, fields=None):
+    # Prefers asset_metadata.db if there is one, unless asset_metadata.json has changed since (like after sync_asset_metadata.py). If fields is given, the JSON metadata is streamed instead of loaded, see StreamingMetadata.
+    # Raises FileNotFoundError if there's no metadata at all.
+    db_path = folder / "asset_metadata.db"
+    metadata_path = metadata_files.find_metadata(folder)
+
+    if db_path.exists():
+        if metadata_path is None or db_path.stat().st_mtime >= metadata_path.stat().st_mtime:
+            return SqliteMetadata(db_path)
+
+        print(f"\nWarning: {db_path.name} is older than {metadata_path.name}, so {metadata_path.name} is read instead. Convert it again with convert_asset_metadata.py to use {db_path.name}.")
+
+    if metadata_path is None:
+        raise FileNotFoundError(folder / "asset_metadata.json")
+
+    if fields is not None:
+        return StreamingMetadata(metadata_path, fields)
+
+    if compact_in_memory:
+        return JsonMetadata(compact_metadata.load_compact(metadata_path))
+
+    with metadata_files.open_read(metadata_path) as f:
+        return JsonMetadata(json.load(f))
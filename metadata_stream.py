@@ -0,0 +1,174 @@
+import json
+from json.decoder import scanstring, WHITESPACE
+import metadata_files
+
+
+# Reads asset_metadata.json one asset at a time instead of loading the whole file, keeping only the fields a script asks for. Not meant to be run on its own.
+# Memory use only depends on the size of the largest single asset, and scripts can start working on the first assets right away.
+
+
+READ_CHUNK = 1024*1024 # Characters read from the file at a time
+
+
+class JsonStream:
+    # Just enough of a JSON tokenizer to walk the top two levels of asset_metadata.json, handing every value below that to json's own decoder
+
+    def __init__(self, f, decoder=None):
+        self.f = f
+        self.buffer = ""
+        self.position = 0
+        self.eof = False
+        self.decoder = decoder or json.JSONDecoder()
+
+    def fill(self):
+        # Drops everything already parsed and reads the next chunk. Returns False at the end of the file.
+        if self.eof:
+            return False
+
+        chunk = self.f.read(READ_CHUNK)
+        self.buffer = self.buffer[self.position:] + chunk
+        self.position = 0
+
+        if not chunk:
+            self.eof = True
+
+        return bool(chunk)
+
+    def skip_whitespace(self):
+        while True:
+            self.position = WHITESPACE.match(self.buffer, self.position).end()
+
+            if self.position < len(self.buffer) or not self.fill():
+                return
+
+    def next_character(self):
+        self.skip_whitespace()
+
+        if self.position >= len(self.buffer):
+            raise ValueError("Unexpected end of metadata file")
+
+        character = self.buffer[self.position]
+        self.position += 1
+
+        return character
+
+    def expect(self, expected):
+        character = self.next_character()
+
+        if character not in expected:
+            raise ValueError(f"Expected {expected!r} in metadata file but found {character!r}")
+
+        return character
+
+    def read_value(self):
+        # Values can be split across chunks, so keep reading until the decoder gets a complete one
+        self.skip_whitespace()
+
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.position)
+
+                # A number right at the end of the buffer might continue in the next chunk
+                if end < len(self.buffer) or self.eof or not isinstance(value, (int, float)):
+                    self.position = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+
+            if not self.fill():
+                self.eof = True
+
+    def read_key(self):
+        self.expect('"')
+
+        while True:
+            try:
+                key, end = scanstring(self.buffer, self.position)
+                self.position = end
+                break
+            except json.JSONDecodeError:
+                if not self.fill():
+                    raise
+
+        self.expect(":")
+
+        return key
+
+    def iter_object(self):
+        # Yields each key of an object, the caller must read (or descend into) the value before asking for the next key
+        self.expect("{")
+
+        if self.next_character() == "}":
+            return
+
+        self.position -= 1
+
+        while True:
+            yield self.read_key()
+
+            if self.expect(",}") == "}":
+                return
+
+
+def get_field(value, field_path):
+    for key in field_path.split("."):
+        if not isinstance(value, dict) or key not in value:
+            return None
+
+        value = value[key]
+
+    return value
+
+
+def set_field(target, field_path, value):
+    keys = field_path.split(".")
+
+    for key in keys[:-1]:
+        target = target.setdefault(key, {})
+
+    target[keys[-1]] = value
+
+
+def read_header(metadata_path):
+    # Returns every top level value except asset_metadata, which is where the script stops reading
+    header = {}
+
+    with metadata_files.open_read(metadata_path) as f:
+        stream = JsonStream(f)
+
+        for key in stream.iter_object():
+            if key == "asset_metadata":
+                break
+
+            header[key] = stream.read_value()
+
+    return header
+
+
+def iter_assets(metadata_path, fields):
+    # Yields (asset ID, asset) for every asset, where asset only has the dotted field paths asked for, e.g. ["full_metadata.previews.images"]. With fields=None, the whole asset is kept.
+    with metadata_files.open_read(metadata_path) as f:
+        stream = JsonStream(f)
+
+        for key in stream.iter_object():
+            if key != "asset_metadata":
+                stream.read_value()
+                continue
+
+            for asset_id in stream.iter_object():
+                asset = stream.read_value()
+
+                if fields is None:
+                    yield asset_id, asset
+                    continue
+
+                partial_asset = {}
+
+                for field_path in fields:
+                    value = get_field(asset, field_path)
+
+                    if value is not None:
+                        set_field(partial_asset, field_path, value)
+
+                yield asset_id, partial_asset
@@ -0,0 +1,290 @@
+import io
+import json
+import math
+import time
+import base64
+import random
+import zipfile
+import hashlib
+import argparse
+import threading
+from urllib.parse import urlsplit, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+# A local stand-in for the Quixel servers, used by benchmark_scripts.py to measure the scripts without touching quixel.com.
+# It serves /v1/assets, /v1/assets/{id}, /v1/assets/acquired, /v1/acl, /v1/downloads, the asset download server (under /assetdownloads) and preview images (under /images).
+# With a packaging time, each download request takes up to that long to answer, like the real servers preparing a zip. How long depends on the asset (between 15% and all of it), since bigger assets take longer. With a download ID lifetime, older download IDs answer 404.
+# With a token lifetime, it also hands out expiring JWTs from /v1/auth/refresh and answers "Expired token" to requests made with an expired one, like the real servers.
+# Full metadata, zips and images are generated, so any list of asset IDs and names (like the shipped basic metadata) is enough to run it.
+# It can also be run on its own: python mock_quixel_server.py --help
+
+
+asset_types = ["surface", "atlas", "3d", "brush", "3dplant"]
+component_types = ["albedo", "ao", "displacement", "normal", "roughness", "specular"]
+original_dates = {"created": "2023-11-01T00:00:00.000Z", "approvedAt": "2023-12-01T00:00:00.000Z", "revised": "2024-01-01T00:00:00.000Z"}
+
+
+def make_full_metadata(asset_id, name, index, revised=original_dates["revised"]):
+    return {"id": asset_id,
+            "name": name,
+            "semanticTags": {"asset_type": asset_types[index % len(asset_types)]},
+            "categories": [asset_types[index % len(asset_types)]],
+            "tags": ["mock"],
+            "created": original_dates["created"],
+            "approvedAt": original_dates["approvedAt"],
+            "revised": revised,
+            "components": [{"type": component_type,
+                            "name": component_type.title(),
+                            "uris": [{"resolutions": [{"resolution": "8192x8192", "formats": [{"mimeType": "image/x-exr", "size": (1024*1024)*(10 + index % 7)},
+                                                                                            {"mimeType": "image/jpeg", "size": (1024*1024)*(2 + index % 3)}]}]}]}
+                           for component_type in component_types[:3 + index % 4]],
+            "previews": {"images": [{"uri": f"/quixel-megascans-assets/{asset_id}/{asset_id}_preview_{number}.png", "resolution": "1024x1024"} for number in range(3)]}}
+
+
+def make_zip(payload_size):
+    # Random (incompressible) data split over a few members, so downloading and verifying it costs about as much as a real asset
+    data = random.Random(0).randbytes(payload_size)
+    zip_buffer = io.BytesIO()
+    member_size = math.ceil(payload_size / 4) or 1
+
+    with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED, compresslevel=1) as zipped_file:
+        for number, start in enumerate(range(0, max(payload_size, 1), member_size)):
+            zipped_file.writestr(f"texture_{number}.exr", data[start:start + member_size])
+
+    return zip_buffer.getvalue()
+
+
+class MockQuixel:
+    def __init__(self, assets, latency=0, error_rate=0, payload_size=(1024*1024)*4, image_size=1024*256, token_lifetime=0, packaging_time=0, download_id_lifetime=0):
+        self.assets = assets # [(asset ID, name), ...]
+        self.indexes = {asset_id: index for index, (asset_id, name) in enumerate(assets)}
+        self.latency = latency
+        self.error_rate = error_rate
+        self.zip_data = make_zip(payload_size)
+        self.image_data = random.Random(1).randbytes(image_size)
+        self.image_etag = f"\"{hashlib.md5(self.image_data).hexdigest()}\""
+        self.facets = {"type": {asset_type: len(assets[index::len(asset_types)]) for index, asset_type in enumerate(asset_types)}}
+        self.token_lifetime = token_lifetime # Seconds each issued token is valid for, 0 accepts any token forever
+        self.refresh_token = f"mock-refresh-{random.getrandbits(64):016x}"
+        self.packaging_time = packaging_time # Most extra seconds a POST to /v1/downloads takes
+        self.download_id_lifetime = download_id_lifetime # Seconds each download ID can be downloaded with, 0 for forever
+        self.revisions = {} # Asset ID: revision date, for assets revised since the original dates
+
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.bytes_sent = 0
+        self.connections = 0
+
+    def count(self, sent, error=False):
+        with self.lock:
+            self.requests += 1
+            self.bytes_sent += sent
+            self.errors += error
+
+    def stats(self):
+        with self.lock:
+            return {"requests": self.requests, "errors": self.errors, "bytes_sent": self.bytes_sent, "connections": self.connections}
+
+    def reset_stats(self):
+        with self.lock:
+            self.requests = 0
+            self.errors = 0
+            self.bytes_sent = 0
+            self.connections = 0
+
+    def count_connection(self):
+        with self.lock:
+            self.connections += 1
+
+    def issue_token(self):
+        # An unsigned JWT, which is all the scripts look at
+        def encode(value):
+            return base64.urlsafe_b64encode(json.dumps(value).encode("utf-8")).decode("ascii").rstrip("=")
+
+        return f"{encode({"alg": "none", "typ": "JWT"})}.{encode({"sub": "mock", "exp": int(time.time() + self.token_lifetime)})}.mock"
+
+    def token_expired(self, token):
+        if not self.token_lifetime or not token:
+            return False
+
+        try:
+            payload = token.split(".")[1]
+            return json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))["exp"] <= time.time()
+        except (IndexError, ValueError, KeyError):
+            return False # Anything that isn't one of our JWTs (like "mock-token") never expires
+
+    def download_id_expired(self, download_id):
+        # Download IDs look like {asset}-{issued}-{random}
+        try:
+            return bool(self.download_id_lifetime) and time.time() - float(download_id.rsplit("-", 2)[1]) > self.download_id_lifetime
+        except (IndexError, ValueError):
+            return True
+
+    def revise(self, asset_ids):
+        # Gives the assets a new revision date, in both the listing and their full metadata
+        revised = time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime())
+
+        for asset_id in asset_ids:
+            self.revisions[asset_id] = revised
+
+    def page(self, limit, page):
+        page_assets = self.assets[(page - 1) * limit:page * limit]
+
+        return {"assets": [original_dates | {"id": asset_id, "name": name, "revised": self.revisions.get(asset_id, original_dates["revised"])} for asset_id, name in page_assets],
+                "page": page,
+                "pages": math.ceil(len(self.assets) / limit),
+                "count": len(page_assets),
+                "total": len(self.assets),
+                "facets": self.facets}
+
+
+def make_handler(mock):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1" # Keep-alive, like the real servers
+
+        def setup(self):
+            super().setup()
+            mock.count_connection() # Called once per connection, so scripts that don't reuse theirs show up in the benchmark
+
+        def log_message(self, format, *args):
+            pass
+
+        def send(self, status, body=b"", content_type="application/json", headers=None):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+
+            self.end_headers()
+
+            if self.command != "HEAD":
+                self.wfile.write(body)
+
+            mock.count(len(body), error=status >= 500)
+
+        def send_json(self, value, status=200, headers=None):
+            self.send(status, json.dumps(value).encode("utf-8"), headers=headers)
+
+        def send_ranged(self, data, content_type, headers):
+            # Supports "Range: bytes=start-", which is all the scripts ever ask for
+            byte_range = self.headers.get("Range")
+
+            if byte_range and byte_range.startswith("bytes=") and byte_range.endswith("-"):
+                start = int(byte_range.removeprefix("bytes=").removesuffix("-"))
+
+                if start >= len(data):
+                    self.send(416, headers={"Content-Range": f"bytes */{len(data)}"})
+                else:
+                    self.send(206, data[start:], content_type, headers | {"Content-Range": f"bytes {start}-{len(data) - 1}/{len(data)}"})
+            else:
+                self.send(200, data, content_type, headers)
+
+        def handle_request(self):
+            url = urlsplit(self.path)
+            path = url.path
+            query = parse_qs(url.query)
+            body = {}
+
+            if self.command == "POST": # Always read the body, or the next request on this connection would start in the middle of it
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length) or b"{}")
+
+            if mock.latency:
+                time.sleep(mock.latency)
+
+            if mock.error_rate and random.random() < mock.error_rate:
+                self.send_json({"message": "Mock server error"}, 503, {"Retry-After": "1"})
+                return
+
+            if path in ("/v1/assets/acquired", "/v1/acl", "/v1/downloads") and mock.token_expired(self.headers.get("Authorization")):
+                self.send_json({"message": "Expired token"}, 401)
+            elif path == "/v1/auth/refresh" and self.command == "POST":
+                if body.get("refreshToken") == mock.refresh_token:
+                    self.send_json({"token": mock.issue_token(), "refreshToken": mock.refresh_token})
+                else:
+                    self.send_json({"message": "Invalid refresh token"}, 401)
+            elif path == "/v1/assets" and self.command == "GET":
+                self.send_json(mock.page(int(query.get("limit", ["1"])[0]), int(query.get("page", ["1"])[0])))
+            elif path == "/v1/assets/acquired":
+                self.send_json([{"assetID": asset_id} for asset_id, name in mock.assets])
+            elif path.startswith("/v1/assets/"):
+                asset_id = path.removeprefix("/v1/assets/")
+
+                if asset_id in mock.indexes:
+                    index = mock.indexes[asset_id]
+                    self.send_json(make_full_metadata(asset_id, mock.assets[index][1], index, mock.revisions.get(asset_id, original_dates["revised"])))
+                else:
+                    self.send_json({"code": "ASSET_DOES_NOT_EXIST"}, 404)
+            elif path == "/v1/acl" and self.command == "POST":
+                self.send_json({})
+            elif path == "/v1/downloads" and self.command == "POST":
+                if body.get("asset") in mock.indexes:
+                    time.sleep(mock.packaging_time * (0.15 + 0.85 * (mock.indexes[body["asset"]] % 7) / 6))
+                    self.send_json({"id": f"{body["asset"]}-{time.time():.3f}-{random.getrandbits(32):08x}"})
+                else:
+                    self.send_json({"code": "ASSET_DOES_NOT_EXIST"}, 404)
+            elif path.startswith("/assetdownloads/download/"):
+                if mock.download_id_expired(path.removeprefix("/assetdownloads/download/")):
+                    self.send_json({"message": "Download not found"}, 404)
+                    return
+
+                self.send_ranged(mock.zip_data, "application/zip", {})
+            elif path.startswith("/images/"):
+                if self.headers.get("If-None-Match") == mock.image_etag:
+                    self.send(304, headers={"ETag": mock.image_etag})
+                else:
+                    self.send_ranged(mock.image_data, "image/png", {"ETag": mock.image_etag})
+            else:
+                self.send_json({"message": "Not found"}, 404)
+
+        def do_GET(self):
+            self.handle_request()
+
+        def do_HEAD(self):
+            self.handle_request()
+
+        def do_POST(self):
+            self.handle_request()
+
+    return Handler
+
+
+def start_server(mock, port=0):
+    # Runs the server on a background thread, returns it and its base URL
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(mock))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a local stand-in for the Quixel servers.")
+    parser.add_argument("--assets", type=int, default=1000, help="Number of generated assets")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0, help="Seconds added to every response")
+    parser.add_argument("--error-rate", type=float, default=0, help="Fraction of requests answered with a 503")
+    parser.add_argument("--payload-size", type=float, default=4, help="Size of each asset zip in MB")
+    parser.add_argument("--image-size", type=float, default=256, help="Size of each preview image in KB")
+    parser.add_argument("--token-lifetime", type=float, default=0, help="Seconds each issued token is valid for (0 for tokens that never expire)")
+    parser.add_argument("--packaging-time", type=float, default=0, help="Most seconds a download request takes to answer, depending on the asset")
+    parser.add_argument("--download-id-lifetime", type=float, default=0, help="Seconds each download ID is valid for (0 for IDs that never expire)")
+    args = parser.parse_args()
+
+    mock = MockQuixel([(f"mock{number:06d}", f"Mock Asset {number}") for number in range(args.assets)], args.latency, args.error_rate, int(args.payload_size * 1024 * 1024), int(args.image_size * 1024), args.token_lifetime, args.packaging_time, args.download_id_lifetime)
+    server, base_url = start_server(mock, args.port)
+
+    print(f"Mock Quixel server running at {base_url}. Point the scripts at it with QUIXEL_MOCK_SERVER={base_url}")
+    if args.token_lifetime:
+        print(f"Use this token, which refreshes itself with QUIXEL_REFRESH_URL={base_url}/v1/auth/refresh: {json.dumps({"token": mock.issue_token(), "refreshToken": mock.refresh_token})}")
+    print("Press Ctrl+C to stop.")
+
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,51 @@
+import time
+from pathlib import Path
+import asset_index
+
+
+# Searches Quixel (asset_metadata.json or .db) and Fab (fab_asset_metadata.tar.zst, shipped in this repository) metadata with queries like: category=3d AND tag=rock AND has=displacement
+# See asset_index.py for every field you can search. Type "fields" to list them along with their most common values, or leave the query empty to exit.
+# The same queries can be given to download_all_assets.py (instead of an asset category) and download_all_images.py (with --query).
+
+
+shown_results = 20 # Number of matching assets listed for each query
+
+
+def show_fields(index):
+    for field in sorted(index.postings.keys() - {"id"}): # Every ID is its own value
+        values = index.values(field)
+        print(f"{field}: {", ".join(f"{value} ({count})" for value, count in list(values.items())[:15])}{", ..." if len(values) > 15 else ""}")
+
+
+folder = Path(input("Enter the FULL path of the folder with asset_metadata.json (Fab metadata is found next to this script if it isn't there): "))
+indexes = {}
+
+for catalog, load_index in [("Quixel", asset_index.load_quixel_index), ("Fab", asset_index.load_fab_index)]:
+    try:
+        indexes[catalog] = load_index(folder)
+        print(f"{catalog}: {len(indexes[catalog].ids)} assets indexed.")
+    except FileNotFoundError:
+        print(f"No {catalog} metadata found, skipping it.")
+
+while indexes and (query := input("\nQuery: ").strip()):
+    for catalog, index in indexes.items():
+        if query == "fields":
+            print(f"\n{catalog} fields:")
+            show_fields(index)
+            continue
+
+        try:
+            start = time.perf_counter()
+            matches = index.query(query)
+            elapsed = time.perf_counter() - start
+        except ValueError as ex:
+            print(f"\n{catalog}: {ex}")
+            continue
+
+        print(f"\n{catalog}: {len(matches)} assets match ({elapsed * 1000:.1f} ms)")
+
+        names = dict(zip(index.ids, index.names))
+        for asset_id in matches[:shown_results]:
+            print(f"  {asset_id}  {names[asset_id]}")
+        if len(matches) > shown_results:
+            print(f"  ... and {len(matches) - shown_results} more")
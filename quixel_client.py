@@ -0,0 +1,313 @@
+import os
+import time
+import random
+import threading
+import requests
+from email.utils import parsedate_to_datetime
+from requests.adapters import HTTPAdapter
+import quixel_metrics
+
+
+# Shared HTTP client used by every script. Not meant to be run on its own.
+# All requests go through one keep-alive session, so repeated calls to the Quixel servers reuse their connections instead of doing a new TLS handshake each time.
+# Failed requests are retried with exponential backoff and jitter, honoring Retry-After when the server sends it.
+# There is (intentionally) still no limit on retries - once an endpoint has used up its retry budget, retries simply slow down to the maximum delay.
+# Scripts pace their requests with an AdaptiveLimiter, which speeds up while the server keeps up and backs off as soon as it struggles.
+
+
+pool_size = 32 # Maximum number of kept-alive connections per host, should be at least as large as the number of workers in any script
+base_delay = 1 # Delay in seconds before the first retry, doubled on each retry after that
+max_delay = 120 # Upper limit for the delay between retries in seconds
+retry_budget_ratio = 0.2 # Each endpoint may retry this many times per request sent to it before retries slow down to max_delay
+retry_budget_minimum = 10 # Number of retries each endpoint is always allowed, so a handful of early errors don't exhaust the budget
+timeout = (15, 120) # Connect and read timeouts in seconds
+
+adaptive_pacing = True # Set to False to always send requests at the rate and concurrency each script starts with
+minimum_rate = 0.2 # Lowest request rate (per second) an endpoint is slowed down to
+maximum_rate = 50 # Highest request rate (per second) an endpoint is sped up to
+rate_step = 1 # Requests per second added after every healthy adjust_interval
+decrease_factor = 0.5 # Rate and concurrency are multiplied by this when the server struggles
+latency_factor = 2 # Responses taking this many times longer than the fastest seen count as the server struggling
+adjust_interval = 1 # Seconds between adjustments
+
+
+# Set by benchmark_scripts.py to send every request to mock_quixel_server.py instead of the real servers
+mock_server = os.environ.get("QUIXEL_MOCK_SERVER")
+mock_paths = {"https://quixel.com/": "/",
+              "https://assetdownloads.quixel.com/": "/assetdownloads/",
+              "https://ddinktqu5prvc.cloudfront.net/": "/images/"}
+
+
+session = requests.Session()
+adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+session.mount("https://", adapter)
+session.mount("http://", adapter)
+stop_event = threading.Event() # Set by a script on Ctrl+C, which cuts retry waits short so its workers can exit
+
+
+class Stopped(Exception):
+    # Raised by request() once stop_event is set, so workers stop instead of retrying in a loop that no longer waits between attempts
+    pass
+
+
+budget_lock = threading.Lock()
+endpoint_requests = {}
+endpoint_retries = {}
+
+
+def retry_budget_left(endpoint):
+    with budget_lock:
+        allowed = retry_budget_minimum + endpoint_requests.get(endpoint, 0) * retry_budget_ratio
+
+        return endpoint_retries.get(endpoint, 0) < allowed
+
+
+def record_request(endpoint):
+    with budget_lock:
+        endpoint_requests[endpoint] = endpoint_requests.get(endpoint, 0) + 1
+
+
+def record_retry(endpoint):
+    with budget_lock:
+        endpoint_retries[endpoint] = endpoint_retries.get(endpoint, 0) + 1
+
+
+def get_retry_after(response):
+    if response is None or "Retry-After" not in response.headers:
+        return None
+
+    retry_after = response.headers["Retry-After"]
+
+    try:
+        return max(float(retry_after), 0)
+    except ValueError:
+        pass
+
+    try:
+        return max(parsedate_to_datetime(retry_after).timestamp() - time.time(), 0)
+    except (TypeError, ValueError):
+        return None
+
+
+class Backoff:
+    # Create one of these per logical request and call wait() every time it has to be retried.
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.attempt = 0
+
+    def delay(self, response=None):
+        retry_after = get_retry_after(response)
+
+        if retry_after is not None:
+            return min(retry_after, max_delay)
+
+        if not retry_budget_left(self.endpoint):
+            return max_delay
+
+        delay = min(base_delay * 2 ** self.attempt, max_delay)
+
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def wait(self, response=None):
+        delay = self.delay(response)
+        self.attempt += 1
+        record_retry(self.endpoint)
+        quixel_metrics.increment("quixel_retries_total", endpoint=self.endpoint)
+        quixel_metrics.record_sleep("backoff", delay)
+
+        print(f"Waiting {delay:.1f} seconds and retrying.")
+        stop_event.wait(delay)
+
+
+class RateLimiter:
+    # Token bucket shared between threads. Each request takes a token, and tokens refill at rate per second up to burst.
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                wait = (1 - self.tokens) / self.rate
+
+            quixel_metrics.record_sleep("rate_limit", wait)
+
+            if stop_event.wait(wait): # At the lowest rates this can be several seconds, so Ctrl+C cuts it short
+                raise Stopped("Stopped waiting to send a request")
+
+
+class AdaptiveLimiter:
+    # Paces the requests to one endpoint with AIMD (additive increase, multiplicative decrease), the same way TCP finds out how fast it can send. Pass it to get() or post() as limiter=.
+    # Every adjust_interval that the server answers quickly and without errors, the rate goes up by rate_step and one more request may be in flight, up to max_concurrency (the script's number of workers).
+    # A 429, 5xx or connection error, or responses getting latency_factor times slower than the fastest seen, cut both by decrease_factor (at most once per adjust_interval, so one burst of errors doesn't cut them to nothing).
+    # Pass latency_sensitive=False for endpoints whose responses take longer the more work they do (like packaging an asset), where slow responses don't mean the server is struggling. Only errors slow those down.
+    # Streamed responses (stream=True) keep their slot until the body has been read or the response is closed, so the concurrency limit covers the transfers themselves.
+    # The starting rate is the one the script asks for, and with adaptive_pacing off the limiter just keeps it.
+
+    def __init__(self, endpoint, rate, max_concurrency=1, latency_sensitive=True):
+        self.endpoint = endpoint
+        self.rate = rate
+        self.max_concurrency = max_concurrency
+        self.latency_sensitive = latency_sensitive
+        self.concurrency = max_concurrency # Starts out at the script's number of workers, and only drops below it while the server struggles
+        self.bucket = RateLimiter(rate, burst=max_concurrency)
+        self.condition = threading.Condition()
+        self.in_flight = 0
+        self.best_latency = None
+        self.last_decrease = 0
+        self.start_window(time.monotonic())
+        self.publish()
+
+    def start_window(self, now):
+        self.window_start = now
+        self.window_requests = 0
+        self.window_latency = 0
+        self.saturated = False # Whether requests had to wait for a free slot, otherwise more concurrency wouldn't help
+
+    def publish(self):
+        quixel_metrics.set_gauge("quixel_rate_limit", self.rate, endpoint=self.endpoint)
+        quixel_metrics.set_gauge("quixel_concurrency_limit", self.concurrency, endpoint=self.endpoint)
+
+    def acquire(self):
+        with self.condition:
+            while self.in_flight >= self.concurrency:
+                if stop_event.is_set(): # Woken up by a request that gave up its slot because the script is stopping
+                    raise Stopped("Stopped waiting to send a request")
+
+                self.saturated = True
+                self.condition.wait()
+
+            self.in_flight += 1
+
+        try:
+            self.bucket.acquire()
+        except Stopped:
+            with self.condition:
+                self.in_flight -= 1
+                self.condition.notify_all()
+
+            raise
+
+    def release(self, status, seconds):
+        with self.condition:
+            self.in_flight -= 1
+            self.window_requests += 1
+            self.window_latency += seconds
+            now = time.monotonic()
+
+            if adaptive_pacing:
+                if status == "error" or status == 429 or status >= 500:
+                    if now - self.last_decrease >= adjust_interval:
+                        self.decrease(now)
+                elif now - self.window_start >= adjust_interval:
+                    self.adjust(now)
+
+            self.condition.notify_all()
+
+    def adjust(self, now):
+        average = self.window_latency / self.window_requests
+        busy = self.saturated or self.window_requests >= self.rate * (now - self.window_start) * 0.8 # Only speed up if the limits are what's holding requests back
+
+        if self.latency_sensitive and self.best_latency is not None and average > self.best_latency * latency_factor:
+            self.decrease(now)
+        elif busy and now - self.last_decrease >= adjust_interval:
+            self.rate = min(self.rate + rate_step, maximum_rate)
+            self.concurrency = min(self.concurrency + 1, self.max_concurrency)
+            self.bucket.rate = self.rate
+            self.publish()
+
+        # The fastest latency slowly creeps back up, so a server that got slower for good doesn't keep getting throttled
+        self.best_latency = average if self.best_latency is None else min(average, self.best_latency * 1.05)
+        self.start_window(now)
+
+    def decrease(self, now):
+        self.rate = max(self.rate * decrease_factor, minimum_rate)
+        self.concurrency = max(int(self.concurrency * decrease_factor), 1)
+        self.bucket.rate = self.rate
+        self.last_decrease = now
+        self.publish()
+        self.start_window(now)
+
+
+def hold_slot(response, limiter, status, seconds):
+    # Releases limiter's slot once urllib3 gives the connection back, which it does when the body has been read to the end, the response is closed or reading it fails
+    release_conn = response.raw.release_conn
+    released = False
+
+    def release_slot():
+        nonlocal released
+        release_conn()
+
+        if not released:
+            released = True
+            limiter.release(status, seconds)
+
+    response.raw.release_conn = release_slot
+
+
+def resolve_url(url):
+    if mock_server:
+        for prefix, path in mock_paths.items():
+            if url.startswith(prefix):
+                return mock_server + path + url.removeprefix(prefix)
+
+    return url
+
+
+def request(method, url, endpoint, limiter=None, **kwargs):
+    # Connection errors are always retried here, any other error is left to the caller to inspect through the response
+    backoff = Backoff(endpoint)
+    kwargs.setdefault("timeout", timeout)
+    url = resolve_url(url)
+
+    while True:
+        if stop_event.is_set(): # Checked before every attempt, including the ones after backoff.wait(), which returns right away once the script is stopping
+            raise Stopped(f"Stopped before requesting {url}")
+
+        if limiter is not None:
+            limiter.acquire()
+
+        record_request(endpoint)
+        start = time.monotonic()
+        status = "error"
+        held = False
+
+        try:
+            response = session.request(method, url, **kwargs)
+            status = response.status_code
+
+            if limiter is not None and kwargs.get("stream"): # Latency is still measured up to the headers, only the slot is kept
+                hold_slot(response, limiter, status, time.monotonic() - start)
+                held = True
+
+            return response
+        except (requests.ConnectionError, requests.Timeout) as ex:
+            print(f"\nConnection error while requesting {url}! Exception was {ex}")
+        finally:
+            quixel_metrics.record_response(endpoint, status, time.monotonic() - start)
+
+            if limiter is not None and not held:
+                limiter.release(status, time.monotonic() - start)
+
+        backoff.wait()
+
+
+def get(url, endpoint, limiter=None, **kwargs):
+    return request("GET", url, endpoint, limiter, **kwargs)
+
+
+def post(url, endpoint, limiter=None, **kwargs):
+    return request("POST", url, endpoint, limiter, **kwargs)
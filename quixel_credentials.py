@@ -0,0 +1,210 @@
+import os
+import json
+import time
+import base64
+import threading
+import subprocess
+from pathlib import Path
+import quixel_client
+
+
+# Keeps the Quixel token fresh without stopping a run to ask for a new one. Not meant to be run on its own.
+# Quixel tokens are JWTs, so when they expire is known ahead of time. Shortly before the token expires (or as soon as the server says it has), a new one is looked for in the background, taking the first of:
+#   refresh_command, a command of your own that prints a fresh token
+#   refresh_url, a service that trades the refresh token (included when you copy the auth cookie from Chrome) for a new token
+#   token_file, which you can paste a new token into at any time
+#   the console, where you can also paste it
+# Only requests that need the new token wait for it. Downloads that are already running carry on, and so does everything else while the old token is still valid.
+
+
+refresh_margin = 120 # Seconds before a token expires that a new one is looked for
+token_file = Path("quixel_token.txt") # Read for the first token if it exists, and checked for a new one whenever it's needed. Relative to where the script is run.
+refresh_command = None # Shell command that prints a fresh token (in any format the token prompt accepts), like "python my_refresh.py"
+refresh_url = os.environ.get("QUIXEL_REFRESH_URL") # POSTed {"refreshToken": ...}, should answer {"token": ..., "refreshToken": ...}. Set by benchmark_scripts.py to mock_quixel_server.py's.
+prompt_for_token = True # Set to False to never ask in the console, for runs nobody is watching
+poll_interval = 5 # Seconds between checks for a new token while waiting for one
+
+
+class Stopped(quixel_client.Stopped):
+    # Raised by CredentialProvider.get() once the script is stopping, so workers waiting for a new token give up instead of keeping it from exiting
+    pass
+
+
+def parse_token(text):
+    # Returns (token, refresh token or None) from whatever was copied out of the browser
+    text = text.strip()
+
+    if text.startswith("token:\""): # Copying from Firefox dev tools, remove extra json data
+        return text.removeprefix("token:\"").removesuffix("\""), None
+
+    if text.startswith("{"): # Copying from Chrome dev tools, which includes the refresh token
+        try:
+            cookie = json.loads(text)
+
+            return cookie["token"], cookie.get("refreshToken")
+        except (json.JSONDecodeError, KeyError, TypeError):
+            return text.split("\":\"")[1].split("\",\"")[0], None
+
+    return text, None
+
+
+def token_expiry(token):
+    # Returns the token's expiry as a Unix timestamp, or None if it isn't a JWT (or doesn't say)
+    try:
+        payload = token.split(".")[1]
+        claims = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+
+        return float(claims["exp"])
+    except (IndexError, ValueError, KeyError, TypeError):
+        return None
+
+
+def read_first_token(prompt):
+    # QUIXEL_TOKEN or token_file if either has a token, otherwise asks
+    if os.environ.get("QUIXEL_TOKEN"):
+        return os.environ["QUIXEL_TOKEN"]
+
+    try:
+        text = token_file.read_text(encoding="utf-8").strip()
+
+        if text:
+            print(f"Using the token in {token_file}.")
+            return text
+    except FileNotFoundError:
+        pass
+
+    return input(prompt)
+
+
+class CredentialProvider:
+    def __init__(self, prompt):
+        self.token, self.refresh_token = parse_token(read_first_token(prompt))
+        self.obtained = time.time()
+        self.rejected = set() # Tokens the server has turned down
+        self.condition = threading.Condition()
+        self.refreshing = False
+        self.typed = None # Token pasted into the console while refreshing
+        self.prompting = False
+        self.console_closed = False
+        self.stopped = False
+
+    def usable(self, token):
+        expiry = token_expiry(token)
+
+        return token not in self.rejected and (expiry is None or expiry > time.time())
+
+    def needs_refresh(self, token):
+        expiry = token_expiry(token)
+
+        if token in self.rejected:
+            return True
+        elif expiry is None:
+            return False
+
+        return expiry - time.time() < min(refresh_margin, (expiry - self.obtained) / 2) # Short-lived tokens would otherwise be refreshed nonstop
+
+    def get(self):
+        # Returns a token that hasn't expired, waiting for a new one only if it has
+        with self.condition:
+            while True:
+                if self.stopped:
+                    raise Stopped("Stopped waiting for a Quixel token")
+
+                if self.needs_refresh(self.token) and not self.refreshing:
+                    self.refreshing = True
+                    threading.Thread(target=self.refresh, daemon=True).start()
+
+                if self.usable(self.token):
+                    return self.token
+
+                self.condition.wait(poll_interval) # Also wakes up in time to notice the token expiring
+
+    def expired(self, token):
+        # Call when the server says token has expired. The next get() waits for a new one.
+        with self.condition:
+            self.rejected.add(token)
+            self.condition.notify_all()
+
+    def stop(self):
+        # Call on Ctrl+C. Everything waiting in get() raises Stopped, and nothing more is done to get a new token.
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+
+    def refresh(self):
+        announced = False
+
+        while not self.stopped:
+            for source in [self.from_command, self.from_url, self.from_file, self.from_console]:
+                try:
+                    found = source()
+                except Exception as ex: # A broken source shouldn't stop the others from being tried
+                    print(f"\nCouldn't get a new Quixel token from {source.__name__.removeprefix("from_")}! Exception was {ex}")
+                    found = None
+
+                if found is not None and found[0] != self.token and self.usable(found[0]):
+                    with self.condition:
+                        self.token = found[0]
+                        self.refresh_token = found[1] or self.refresh_token
+                        self.obtained = time.time()
+                        self.refreshing = False
+                        self.condition.notify_all()
+
+                    print(f"\nGot a new Quixel token from {source.__name__.removeprefix("from_")}.")
+                    return
+
+            if not announced:
+                announced = True
+                print(f"\nYour Quixel token {"has expired" if not self.usable(self.token) else "expires soon"}! Paste a new one into {token_file.resolve()}{" or here" if prompt_for_token else ""}. Downloads that are already running will carry on.")
+
+            time.sleep(poll_interval)
+
+    def from_command(self):
+        if not refresh_command:
+            return None
+
+        result = subprocess.run(refresh_command, shell=True, capture_output=True, text=True, timeout=120)
+
+        return parse_token(result.stdout) if result.returncode == 0 and result.stdout.strip() else None
+
+    def from_url(self):
+        if not refresh_url or not self.refresh_token:
+            return None
+
+        response = quixel_client.post(refresh_url, "auth", json={"refreshToken": self.refresh_token})
+
+        if response.status_code != 200:
+            print(f"\nCouldn't refresh the Quixel token, the refresh service answered with status code {response.status_code}.")
+            return None
+
+        json_response = response.json()
+
+        return json_response["token"], json_response.get("refreshToken")
+
+    def from_file(self):
+        try:
+            text = token_file.read_text(encoding="utf-8")
+        except FileNotFoundError:
+            return None
+
+        return parse_token(text) if text.strip() else None
+
+    def from_console(self):
+        if not prompt_for_token or self.console_closed:
+            return None
+
+        if not self.prompting: # input() blocks, so it gets a thread of its own that only this waits on
+            self.prompting = True
+            threading.Thread(target=self.read_console, daemon=True).start()
+
+        typed, self.typed = self.typed, None
+
+        return parse_token(typed) if typed else None
+
+    def read_console(self):
+        try:
+            self.typed = input()
+        except EOFError: # Nothing left to read, like when stdin isn't a terminal
+            self.console_closed = True
+        finally:
+            self.prompting = False
@@ -0,0 +1,219 @@
+import os
+import json
+import time
+import atexit
+import threading
+from pathlib import Path
+
+
+# Collects numbers about a run (request latency, status codes, retries, bytes transferred, time spent sleeping, queue depth) and saves them every so often. Not meant to be run on its own.
+# quixel_metrics.json is for reading yourself, quixel_metrics.prom is in Prometheus' text format for node_exporter's textfile collector.
+# Both are replaced in one step on every save, so they can be read at any time during a run. Set QUIXEL_METRICS_DIR to save them somewhere other than the current directory.
+
+
+metrics_enabled = True # Set to False to stop saving metrics files
+flush_interval = 30 # Seconds between saves of the metrics files
+latency_buckets = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120] # Upper bounds in seconds of the request latency histogram buckets
+
+
+metrics_path = Path(os.environ.get("QUIXEL_METRICS_DIR", "."))
+started = time.time()
+lock = threading.Lock()
+counters = {} # {(name, labels): value}, labels being a sorted tuple of (label, value) pairs
+gauges = {}
+histograms = {} # {(name, labels): [bucket counts..., +Inf count, sum]}
+flush_lock = threading.Lock()
+last_flush = {"time": time.monotonic(), "bytes": {}} # For working out bytes per second between saves
+stop_flushing = threading.Event()
+descriptions = {"quixel_requests_total": ("counter", "Requests sent, by endpoint and status code (or \"error\" for connection errors)"),
+                "quixel_request_seconds": ("histogram", "Time until response headers arrived, by endpoint"),
+                "quixel_retries_total": ("counter", "Retries, by endpoint"),
+                "quixel_transferred_bytes_total": ("counter", "Response body bytes received, by endpoint"),
+                "quixel_transfer_seconds_total": ("counter", "Time spent receiving response bodies, by endpoint"),
+                "quixel_transfer_bytes_per_second": ("gauge", "Bytes received per second since the previous save, by endpoint"),
+                "quixel_sleep_seconds_total": ("counter", "Time spent sleeping, by reason (backoff or rate_limit)"),
+                "quixel_queue_depth": ("gauge", "Work items submitted but not yet finished, by queue"),
+                "quixel_rate_limit": ("gauge", "Requests per second currently allowed, by endpoint"),
+                "quixel_concurrency_limit": ("gauge", "Requests currently allowed in flight at once, by endpoint"),
+                "quixel_uptime_seconds": ("gauge", "Seconds since the script started")}
+
+
+def make_key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def increment(name, value=1, **labels):
+    key = make_key(name, labels)
+
+    with lock:
+        counters[key] = counters.get(key, 0) + value
+
+
+def set_gauge(name, value, **labels):
+    with lock:
+        gauges[make_key(name, labels)] = value
+
+
+def observe(name, value, **labels):
+    key = make_key(name, labels)
+
+    with lock:
+        histogram = histograms.setdefault(key, [0] * (len(latency_buckets) + 2))
+
+        for index, bound in enumerate(latency_buckets):
+            if value <= bound:
+                histogram[index] += 1
+                break
+        else:
+            histogram[-2] += 1
+
+        histogram[-1] += value
+
+
+def record_response(endpoint, status, seconds):
+    increment("quixel_requests_total", endpoint=endpoint, status=str(status))
+    observe("quixel_request_seconds", seconds, endpoint=endpoint)
+
+
+def record_sleep(reason, seconds):
+    increment("quixel_sleep_seconds_total", seconds, reason=reason)
+
+
+def iter_transfer(endpoint, chunks):
+    # Wraps response.iter_content(), counting the bytes and the time spent waiting for them
+    chunks = iter(chunks)
+
+    while True:
+        start = time.monotonic()
+        chunk = next(chunks, None)
+        seconds = time.monotonic() - start
+
+        if chunk is None:
+            increment("quixel_transfer_seconds_total", seconds, endpoint=endpoint)
+            return
+
+        increment("quixel_transferred_bytes_total", len(chunk), endpoint=endpoint)
+        increment("quixel_transfer_seconds_total", seconds, endpoint=endpoint)
+
+        yield chunk
+
+
+def label_key(labels):
+    return ",".join(f"{label}={value}" for label, value in labels) or "all"
+
+
+def format_labels(labels):
+    return "{" + ",".join(f"{label}=\"{value}\"" for label, value in labels) + "}" if labels else ""
+
+
+def estimate_quantile(histogram, quantile):
+    # Upper bound of the bucket the quantile falls in, so it's never lower than the real value
+    count = sum(histogram[:-1])
+    seen = 0
+
+    for bound, bucket_count in zip(latency_buckets + [None], histogram[:-1]):
+        seen += bucket_count
+
+        if count and seen >= quantile * count:
+            return bound
+
+    return None
+
+
+def snapshot():
+    with lock:
+        return dict(counters), dict(gauges), {key: list(value) for key, value in histograms.items()}
+
+
+def to_json(counters, gauges, histograms):
+    metrics = {"updated": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "pid": os.getpid()}
+
+    for (name, labels), value in list(counters.items()) + list(gauges.items()):
+        metrics.setdefault(name.removeprefix("quixel_"), {})[label_key(labels)] = round(value, 3)
+
+    for (name, labels), histogram in histograms.items():
+        count = sum(histogram[:-1])
+        metrics.setdefault(name.removeprefix("quixel_"), {})[label_key(labels)] = {
+            "count": count,
+            "mean": round(histogram[-1] / count, 3) if count else None,
+            "p50": estimate_quantile(histogram, 0.5),
+            "p90": estimate_quantile(histogram, 0.9),
+            "p99": estimate_quantile(histogram, 0.99),
+            "buckets": {str(bound): bucket_count for bound, bucket_count in zip(latency_buckets + ["+Inf"], histogram[:-1])}}
+
+    return metrics
+
+
+def to_prometheus(counters, gauges, histograms):
+    lines = []
+    values = {}
+
+    for (name, labels), value in list(counters.items()) + list(gauges.items()):
+        values.setdefault(name, []).append(f"{name}{format_labels(labels)} {value}")
+
+    for (name, labels), histogram in histograms.items():
+        cumulative = 0
+
+        for bound, bucket_count in zip(latency_buckets + ["+Inf"], histogram[:-1]):
+            cumulative += bucket_count
+            values.setdefault(name, []).append(f"{name}_bucket{format_labels(labels + (("le", bound),))} {cumulative}")
+
+        values[name].append(f"{name}_sum{format_labels(labels)} {histogram[-1]}")
+        values[name].append(f"{name}_count{format_labels(labels)} {cumulative}")
+
+    for name, samples in values.items():
+        metric_type, description = descriptions.get(name, ("untyped", name))
+        lines += [f"# HELP {name} {description}", f"# TYPE {name} {metric_type}"] + samples
+
+    return "\n".join(lines) + "\n"
+
+
+def write_atomically(path, text):
+    temp_path = path.with_name(path.name + ".tmp")
+
+    with open(temp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+
+    os.replace(temp_path, path)
+
+
+def flush():
+    with flush_lock: # The periodic save and the one at exit could otherwise overlap
+        save_metrics()
+
+
+def save_metrics():
+    now = time.monotonic()
+    set_gauge("quixel_uptime_seconds", round(time.time() - started, 1))
+
+    with lock:
+        transferred = {labels: value for (name, labels), value in counters.items() if name == "quixel_transferred_bytes_total"}
+
+    for labels, value in transferred.items():
+        set_gauge("quixel_transfer_bytes_per_second", round((value - last_flush["bytes"].get(labels, 0)) / max(now - last_flush["time"], 1e-9), 1), **dict(labels))
+
+    last_flush["time"] = now
+    last_flush["bytes"] = transferred
+
+    counter_values, gauge_values, histogram_values = snapshot()
+
+    try:
+        write_atomically(metrics_path / "quixel_metrics.json", json.dumps(to_json(counter_values, gauge_values, histogram_values), indent=4))
+        write_atomically(metrics_path / "quixel_metrics.prom", to_prometheus(counter_values, gauge_values, histogram_values))
+    except OSError as ex:
+        print(f"\nCouldn't save metrics to {metrics_path}! Exception was {ex}")
+
+
+def flush_periodically():
+    while not stop_flushing.wait(flush_interval):
+        flush()
+
+
+def stop():
+    stop_flushing.set()
+    flush()
+
+
+if metrics_enabled:
+    threading.Thread(target=flush_periodically, daemon=True).start()
+    atexit.register(stop)
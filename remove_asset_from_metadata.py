@@ -1,7 +1,7 @@
-import requests
 import json
-import time
 from pathlib import Path
+import quixel_client
+import metadata_files
 
 
 # Self explanatory. If you're having issues claiming or downloading an asset because it doesn't exist anymore, this script can help get rid of that error.
@@ -11,26 +11,27 @@ update_basic_stats = True # Set to False if you don't want the stats at the top
 
 
 def query_quixel_page():
+    backoff = quixel_client.Backoff("assets")
+
     while True:
         params = {"limit": 1,
                   "page": 1}
 
-        response = requests.get("https://quixel.com/v1/assets", params=params)
+        response = quixel_client.get("https://quixel.com/v1/assets", "assets", params=params)
 
         if response.status_code != 200:
             print(f"\nEncountered error! (Recieved status code {response.status_code} from Quixel server)")
-            print("Waiting 5 seconds and retrying.")
-            time.sleep(5)
+            backoff.wait(response)
         else:
             return response.json()
 
 
-def save_asset_metadata(asset_metadata, asset_path):
-    with open(asset_path / "asset_metadata.json", "w", encoding="utf-8") as f:
-        json.dump(asset_metadata, f, ensure_ascii=False, indent=4)
+def save_asset_metadata(asset_metadata, metadata_path):
+    with metadata_files.open_write(metadata_files.output_path(metadata_path)) as f:
+        metadata_files.dump(asset_metadata, f)
 
 
-def remove_asset_metadata(asset_metadata, asset_path):
+def remove_asset_metadata(asset_metadata, metadata_path):
     assets = input('\nEnter the ID of the asset(s) you want to delete metadata for, separated by commas (no spaces!) if multiple: ')
 
     for asset in assets.split(","):
@@ -42,7 +43,7 @@ def remove_asset_metadata(asset_metadata, asset_path):
         asset_metadata["total"] = basic_stats["total"]
         asset_metadata["facets"] = basic_stats["facets"]
 
-    save_asset_metadata(asset_metadata, asset_path)
+    save_asset_metadata(asset_metadata, metadata_path)
 
     print('\nAsset(s) deleted and metadata saved!')
 
@@ -50,12 +51,14 @@ def remove_asset_metadata(asset_metadata, asset_path):
 asset_path = Path(input("Enter the FULL path of the folder asset_metadata.json is in: "))
 asset_metadata = None
 
-try:
-    with open(asset_path / "asset_metadata.json", "r", encoding="utf-8") as f:
+metadata_path = metadata_files.find_metadata(asset_path) # asset_metadata.json, or a compressed copy of it
+
+if metadata_path is not None:
+    with metadata_files.open_read(metadata_path) as f:
         asset_metadata = json.load(f)
-except FileNotFoundError:
+else:
     print(f"\n\nCouldn't find asset_metadata.json in the directory you selected, {asset_path}")
     input("Press Enter to exit...")
 
 if asset_metadata:
-    remove_asset_metadata(asset_metadata, asset_path)
\ No newline at end of file
+    remove_asset_metadata(asset_metadata, metadata_path)
\ No newline at end of file
@@ -0,0 +1,67 @@
+import os
+import sys
+import hashlib
+from pathlib import Path
+
+
+# Splits the catalog between several machines, so each one only downloads its own slice. Not meant to be run on its own.
+# Run download_all_assets.py, download_all_images.py or get_all_complete_asset_metadata.py with --shard i/N (or QUIXEL_SHARD=i/N set) on each of N machines, i going from 1 to N.
+# Every machine takes the assets whose ID hashes to its slice, so the slices never overlap and don't change between runs. Every machine has to use the same N.
+# Combine the results afterwards with merge_shards.py.
+
+
+shard = None # (index, count) of this machine's slice, or None for every asset. Set by the scripts with read_shard_argument().
+
+
+def parse_shard(text):
+    # "2/3" -> (2, 3)
+    try:
+        index, count = (int(part) for part in text.split("/"))
+    except ValueError:
+        raise ValueError(f"Couldn't understand shard {text!r}, it should look like 2/3 (the second of three shards)")
+
+    if not 1 <= index <= count:
+        raise ValueError(f"Shard {text!r} doesn't exist, it should be between 1/{count} and {count}/{count}")
+
+    return index, count
+
+
+def get_shard(argv):
+    # Returns (index, count) from --shard i/N, --shard=i/N or QUIXEL_SHARD, or None to take every asset
+    for position, argument in enumerate(argv):
+        if argument == "--shard" and position + 1 < len(argv):
+            return parse_shard(argv[position + 1])
+        elif argument.startswith("--shard="):
+            return parse_shard(argument.removeprefix("--shard="))
+
+    if os.environ.get("QUIXEL_SHARD"):
+        return parse_shard(os.environ["QUIXEL_SHARD"])
+
+    return None
+
+
+def read_shard_argument(argv):
+    # Sets shard from a script's arguments (or QUIXEL_SHARD). A shard that doesn't make sense ends the script with a usage message, before it asks for anything.
+    global shard
+
+    try:
+        shard = get_shard(argv)
+    except ValueError as ex:
+        print(f"{ex}\n\nUsage: python {Path(sys.argv[0]).name} [--shard i/N], with i from 1 to N. QUIXEL_SHARD=i/N works too.\n")
+        input("Press Enter to exit...")
+        sys.exit(2)
+
+
+def shard_of(asset_id, count):
+    # Python's hash() is different in every process, so the slice comes from SHA-256 instead
+    return int.from_bytes(hashlib.sha256(asset_id.encode("utf-8")).digest()[:8], "big") % count + 1
+
+
+def in_shard(asset_id, asset_shard=None):
+    asset_shard = asset_shard or shard
+
+    return asset_shard is None or shard_of(asset_id, asset_shard[1]) == asset_shard[0]
+
+
+def describe():
+    return "every asset" if shard is None else f"shard {shard[0]}/{shard[1]}"
@@ -0,0 +1,165 @@
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from tqdm import tqdm
+import quixel_client
+import quixel_metrics
+import asset_listing
+import metadata_files
+import metadata_store
+import metadata_stream
+import metadata_journal
+
+
+# Brings an existing COMPLETE asset_metadata.json up to date without crawling everything again.
+# The asset listing is compared against your metadata, and full metadata is only requested for assets that are new or have been revised since.
+# Assets that are no longer listed are moved from "asset_metadata" to "removed_assets", so the other scripts stop trying to claim or download them. There's no need for remove_asset_from_metadata.py after this.
+# Like get_all_complete_asset_metadata.py, responses are journaled as they arrive, so if this script is interrupted, just run it again.
+
+
+sync_workers = 4 # Most assets requested at the same time
+requests_per_second = 4 # Requests sent to the Quixel servers per second at first, across all workers. quixel_client adjusts it to what the servers can handle, unless adaptive_pacing is turned off there.
+revision_fields = ["revised", "approvedAt", "created"] # Compared between the listing and your metadata to find revised assets, when the listing includes them
+
+
+metadata_path = metadata_files.find_metadata(Path(".")) # asset_metadata.json, or a compressed copy of it
+pages_path = Path("sync_metadata_pages.jsonl")
+journal_path = Path("asset_metadata.sync.jsonl")
+listing_limiter = quixel_client.AdaptiveLimiter("assets", requests_per_second, sync_workers)
+rate_limiter = quixel_client.AdaptiveLimiter("asset", requests_per_second, sync_workers)
+
+
+def get_compared_fields(listed_asset, local_asset):
+    local_metadata = local_asset.get("full_metadata", {})
+
+    return [field for field in revision_fields if field in listed_asset and field in local_metadata]
+
+
+def is_revised(listed_asset, local_asset):
+    return any(listed_asset[field] != local_asset["full_metadata"][field] for field in get_compared_fields(listed_asset, local_asset))
+
+
+def merged_assets(listed_names, journal, offsets):
+    # Existing assets keep their order and are updated from the journal, new assets follow in listing order. Removed assets are left out.
+    written = set()
+
+    for asset_id, asset in metadata_stream.iter_assets(metadata_path, None):
+        if asset_id not in listed_names:
+            continue
+
+        if asset_id in offsets:
+            asset = {"name": listed_names[asset_id], "full_metadata": metadata_journal.read_entry(journal, offsets[asset_id])["full_metadata"]}
+
+        written.add(asset_id)
+        yield asset_id, asset
+
+    for asset_id, name in listed_names.items():
+        if asset_id not in written and asset_id in offsets:
+            yield asset_id, {"name": name, "full_metadata": metadata_journal.read_entry(journal, offsets[asset_id])["full_metadata"]}
+
+
+def sync_metadata():
+    print(f"Reading revisions from {metadata_path}...")
+    local_assets = dict(metadata_stream.iter_assets(metadata_path, [f"full_metadata.{field}" for field in revision_fields]))
+    old_header = metadata_stream.read_header(metadata_path)
+
+    print(f"{len(local_assets)} assets in {metadata_path}.\n")
+
+    listing_header, listing = asset_listing.fetch_listing(pages_path, sync_workers, listing_limiter)
+    listed_names = {asset["id"]: asset["name"] for asset in listing}
+
+    unchecked_assets = [asset["id"] for asset in listing if asset["id"] in local_assets and not get_compared_fields(asset, local_assets[asset["id"]])]
+
+    if not any(field in asset for asset in listing for field in revision_fields):
+        print(f"\nWarning: the asset listing doesn't include any of {", ".join(revision_fields)}, so revised assets can't be detected, only new and removed ones.")
+    elif unchecked_assets:
+        print(f"\nWarning: {len(unchecked_assets)} assets don't have any of {", ".join(revision_fields)} in both the listing and your metadata, so they can't be checked for revisions.")
+
+    new_assets = [asset["id"] for asset in listing if asset["id"] not in local_assets]
+    revised_assets = [asset["id"] for asset in listing if asset["id"] in local_assets and is_revised(asset, local_assets[asset["id"]])]
+    removed_assets = [asset_id for asset_id in local_assets if asset_id not in listed_names]
+
+    journaled = metadata_journal.load_journal(journal_path)
+    assets_to_query = [asset_id for asset_id in new_assets + revised_assets if asset_id not in journaled]
+
+    print(f"\n{len(new_assets)} new assets, {len(revised_assets)} revised assets and {len(removed_assets)} removed assets.")
+
+    if not new_assets and not revised_assets and not removed_assets:
+        pages_path.unlink()
+        print(f"\n{metadata_path} is already up to date!")
+        return
+
+    print(f"Requesting complete metadata for {len(assets_to_query)} assets. {len(journaled)} were already requested.\n")
+
+    with open(journal_path, "ab") as journal:
+        executor = ThreadPoolExecutor(max_workers=sync_workers)
+        pending = {}
+        progress_bar = tqdm(total=len(assets_to_query))
+
+        def handle_finished(finished):
+            # Only this thread writes to the journal
+            for future in finished:
+                asset_id = pending.pop(future)
+                response = future.result()
+
+                if response != {}:
+                    metadata_journal.append_entry(journal, asset_id, response)
+                else:
+                    print(f"\nQuixel returned empty metadata for asset {asset_id}, skipping it.")
+
+                progress_bar.update(1)
+
+            quixel_metrics.set_gauge("quixel_queue_depth", len(pending), queue="assets")
+
+        try:
+            for asset_id in assets_to_query:
+                pending[executor.submit(asset_listing.query_quixel_asset, asset_id, rate_limiter)] = asset_id
+
+                if len(pending) >= sync_workers * 4: # Don't queue up more than the workers can get through soon
+                    handle_finished(wait(pending, return_when=FIRST_COMPLETED).done)
+
+            while pending:
+                handle_finished(wait(pending, return_when=FIRST_COMPLETED).done)
+        except KeyboardInterrupt:
+            # Workers may be waiting to retry, so they're told to stop rather than waited on. What's in the journal is kept for the next run.
+            quixel_client.stop_event.set()
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+        finally:
+            progress_bar.close()
+
+        executor.shutdown()
+
+    # Removed assets are kept under their own key rather than thrown away
+    header = {key: value for key, value in old_header.items() if key != "removed_assets"}
+    header["total"] = listing_header["total"]
+    header["facets"] = listing_header["facets"]
+
+    removed = {asset_id: asset for asset_id, asset in old_header.get("removed_assets", {}).items() if asset_id not in listed_names}
+    if removed_assets:
+        removed_set = set(removed_assets)
+        removed.update((asset_id, asset) for asset_id, asset in metadata_stream.iter_assets(metadata_path, None) if asset_id in removed_set)
+    if removed:
+        header["removed_assets"] = removed
+
+    saved_path = metadata_files.output_path(metadata_path)
+    print(f"\nSaving {saved_path}... (this will take a while with complete metadata)")
+
+    offsets = metadata_journal.load_journal(journal_path)
+
+    with open(journal_path, "rb") as journal, metadata_files.open_write(saved_path) as f:
+        count = metadata_store.write_asset_metadata(f, header, merged_assets(listed_names, journal, offsets), metadata_files.metadata_indent())
+
+    journal_path.unlink()
+    pages_path.unlink()
+
+    print(f"\nSaved! {saved_path} now has {count} assets.")
+
+    if Path("asset_metadata.db").exists():
+        print(f"Remember to convert {saved_path} to asset_metadata.db again with convert_asset_metadata.py.")
+
+
+if metadata_path is not None:
+    sync_metadata()
+else:
+    print("Couldn't find asset_metadata.json! Run get_all_basic_asset_metadata.py and get_all_complete_asset_metadata.py first.\n")
+    input("Press Enter to exit...")
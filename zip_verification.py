@@ -0,0 +1,428 @@
+import os
+import json
+import time
+import zlib
+import struct
+import hashlib
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+
+# Helpers for checking .zip files. Not meant to be run on its own.
+# StreamingZipVerifier checks the CRC of every member while the zip is being downloaded, so the file doesn't have to be read back from disk and decompressed again afterwards.
+# verify_zip_files checks zips that are already on disk in parallel, and remembers the result in verification_cache.json so unchanged zips are skipped next time.
+# Zips on disk can be checked at three levels, from cheapest to most thorough:
+#   "structural" reads only the central directory and each member's local header, and makes sure they agree and fit in the file. It catches truncated and mangled zips in milliseconds.
+#   "crc" also decompresses every member and checks its CRC, several members at a time.
+#   "full" reads the whole zip front to back, checking every member and calculating its SHA-256 along the way. Only this level gives checksums.
+
+
+LOCAL_HEADER = b"PK\x03\x04"
+DATA_DESCRIPTOR = b"PK\x07\x08"
+END_SIGNATURES = (b"PK\x01\x02", b"PK\x05\x06", b"PK\x06\x06") # Central directory, end of central directory and its zip64 version
+
+DECOMPRESS_CHUNK = 1024*1024 # Upper limit of decompressed bytes held in memory at once
+DECOMPRESS_INPUT_CHUNK = 1024*256 # Compressed bytes given to the decompressor at once while streaming
+MAX_RECORD_LENGTH = 30 + 0xFFFF*2 # Longest possible local header (a name and extra field of 64 KB each), data descriptors are shorter
+READ_CHUNK = (1024*1024)*8
+CACHE_SAVE_INTERVAL = 60 # Seconds between saves of verification_cache.json while verifying
+CRC_WORKERS = 4 # Members of one zip checked at the same time by the "crc" level
+LEVELS = ["structural", "crc", "full"] # Cheapest first
+
+
+class StreamingZipVerifier:
+    # Feed every downloaded chunk to update() in order, then call finish().
+    # Anything this can't follow (encryption, compression other than deflate, stored members of unknown size) makes it give up, in which case finish() returns None and the zip has to be tested the usual way.
+    # Chunks are read where they are. Only a header or data descriptor split between two chunks is copied, so it can be read once the rest of it arrives.
+
+    def __init__(self):
+        self.tail = b"" # Start of a header or data descriptor that the next chunk finishes
+        self.position = 0 # Offset in the zip of the next byte to be read, which ends up where the central directory starts
+        self.members = [] # (name, CRC, size, local header offset, flags, compression method, compressed size) of every member, to compare with the central directory
+        self.state = "header"
+        self.member = None
+        self.decompressor = None
+
+    def update(self, chunk):
+        if self.state in ("done", "failed", "gave_up"):
+            return
+
+        view = memoryview(chunk)
+
+        try:
+            if self.tail: # Joined with as much of the chunk as the split header or descriptor could need, the rest is read in place
+                joined = self.tail + view[:MAX_RECORD_LENGTH].tobytes()
+                used = self.parse(memoryview(joined))
+
+                if used < len(self.tail):
+                    self.tail = joined[used:] + view[MAX_RECORD_LENGTH:].tobytes()
+                    view = view[:0]
+                else:
+                    view = view[used - len(self.tail):]
+                    self.tail = b""
+
+            used = self.parse(view)
+            self.tail += view[used:].tobytes()
+        except (zlib.error, struct.error, UnicodeDecodeError):
+            self.state = "failed"
+
+        if self.state in ("done", "failed", "gave_up"):
+            self.tail = b""
+
+    def parse(self, view):
+        # Reads as far into view as it can, returning how many bytes of it were used
+        position = 0
+
+        while self.state in ("header", "data", "descriptor") and position < len(view):
+            if self.state == "header":
+                used = self.read_header(view[position:])
+            elif self.state == "data":
+                used = self.read_data(view[position:])
+            else:
+                used = self.read_descriptor(view[position:])
+
+            if used is None: # Need more bytes
+                break
+
+            position += used
+            self.position += used
+
+        return position
+
+    def read_header(self, view):
+        if len(view) < 4:
+            return None
+
+        signature = bytes(view[:4])
+
+        if signature in END_SIGNATURES: # All members read, the rest is the central directory
+            self.state = "done"
+            return 0
+        elif signature != LOCAL_HEADER:
+            self.state = "failed"
+            return 0
+
+        if len(view) < 30:
+            return None
+
+        flags, method, crc, compressed_size, file_size, name_length, extra_length = struct.unpack_from("<4x2xHH4xIIIHH", view)
+        header_length = 30 + name_length + extra_length
+
+        if len(view) < header_length:
+            return None
+
+        name = bytes(view[30:30 + name_length]).decode("utf-8" if flags & 0x800 else "cp437")
+        extra = bytes(view[30 + name_length:header_length])
+        zip64 = False
+
+        while len(extra) >= 4: # Look for the zip64 extra field, which holds the real sizes of large members
+            extra_id, extra_size = struct.unpack("<HH", extra[:4])
+
+            if extra_id == 0x0001:
+                zip64 = True
+                zip64_data = extra[4:4 + extra_size]
+
+                if file_size == 0xFFFFFFFF:
+                    file_size, = struct.unpack("<Q", zip64_data[:8])
+                    zip64_data = zip64_data[8:]
+                if compressed_size == 0xFFFFFFFF:
+                    compressed_size, = struct.unpack("<Q", zip64_data[:8])
+
+            extra = extra[4 + extra_size:]
+
+        has_descriptor = bool(flags & 0x8)
+
+        if flags & 0x1 or method not in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED) or (method == zipfile.ZIP_STORED and has_descriptor):
+            self.state = "gave_up"
+            return 0
+
+        self.member = {"name": name,
+                       "flags": flags,
+                       "method": method,
+                       "crc": crc,
+                       "file_size": file_size,
+                       "remaining": compressed_size,
+                       "has_descriptor": has_descriptor,
+                       "zip64": zip64,
+                       "header_offset": self.position,
+                       "compressed_size": 0,
+                       "running_crc": 0,
+                       "running_size": 0}
+        self.decompressor = zlib.decompressobj(-15) if method == zipfile.ZIP_DEFLATED else None
+        self.state = "data"
+
+        return header_length
+
+    def add_output(self, data):
+        self.member["running_crc"] = zlib.crc32(data, self.member["running_crc"])
+        self.member["running_size"] += len(data)
+
+    def decompress(self, data):
+        # Feeds data to the decompressor a piece at a time, so what it holds back between calls stays small. Returns how many bytes of data were used before the deflate stream ended.
+        for start in range(0, len(data), DECOMPRESS_INPUT_CHUNK):
+            piece = data[start:start + DECOMPRESS_INPUT_CHUNK]
+            self.add_output(self.decompressor.decompress(piece, DECOMPRESS_CHUNK))
+
+            while self.decompressor.unconsumed_tail and not self.decompressor.eof:
+                self.add_output(self.decompressor.decompress(self.decompressor.unconsumed_tail, DECOMPRESS_CHUNK))
+
+            if self.decompressor.eof:
+                return start + len(piece) - len(self.decompressor.unused_data)
+
+        return len(data)
+
+    def read_data(self, view):
+        member = self.member
+
+        if member["has_descriptor"]: # Compressed size is unknown, the end of the deflate stream tells us where the member ends
+            used = self.decompress(view)
+            member["compressed_size"] += used
+
+            if self.decompressor.eof:
+                self.state = "descriptor"
+
+            return used
+
+        data = view[:member["remaining"]]
+
+        if self.decompressor is None:
+            self.add_output(data)
+        else:
+            self.decompress(data)
+
+        member["remaining"] -= len(data)
+        member["compressed_size"] += len(data)
+
+        if member["remaining"] == 0:
+            if self.decompressor is not None and not self.decompressor.eof:
+                self.state = "failed"
+            else:
+                self.finish_member(member["crc"], member["file_size"])
+
+        return len(data)
+
+    def read_descriptor(self, view):
+        if len(view) < 4:
+            return None
+
+        offset = 4 if bytes(view[:4]) == DATA_DESCRIPTOR else 0
+        size_format = "<Q" if self.member["zip64"] else "<I"
+        size_length = struct.calcsize(size_format)
+        descriptor_length = offset + 4 + size_length * 2
+
+        if len(view) < descriptor_length:
+            return None
+
+        crc, = struct.unpack_from("<I", view, offset)
+        file_size, = struct.unpack_from(size_format, view, offset + 4 + size_length)
+
+        self.finish_member(crc, file_size)
+
+        return descriptor_length
+
+    def finish_member(self, crc, file_size):
+        if self.member["running_crc"] != crc or self.member["running_size"] != file_size:
+            self.state = "failed"
+        else:
+            self.members.append((self.member["name"], crc, file_size, self.member["header_offset"], self.member["flags"], self.member["method"], self.member["compressed_size"]))
+            self.state = "header"
+
+        self.member = None
+        self.decompressor = None
+
+    def finish(self):
+        if self.state == "gave_up":
+            return None
+
+        return self.state == "done"
+
+
+def verify_streamed_zip(zip_path, verifier):
+    # Returns True or False if the streamed check was conclusive, or None if the zip still needs a full test
+    result = verifier.finish()
+
+    if not result:
+        return result
+
+    # Every member checked out while streaming, so only the central directory needs to be read to make sure it agrees. Where it says members are and how they're stored has to match too, or extracting would read the wrong bytes.
+    try:
+        with zipfile.ZipFile(zip_path) as zipped_file:
+            directory = [(info.orig_filename, info.CRC, info.file_size, info.header_offset, info.flag_bits, info.compress_type, info.compress_size) for info in zipped_file.infolist()]
+            start_dir = zipped_file.start_dir
+    except (zipfile.BadZipFile, OSError, NotImplementedError):
+        return False
+
+    return start_dir == verifier.position and sorted(directory) == sorted(verifier.members)
+
+
+def test_zip_path(zip_path):
+    try:
+        with zipfile.ZipFile(zip_path) as zipped_file:
+            return zipped_file.testzip() is None
+    except (zipfile.BadZipFile, OSError, zlib.error, EOFError, NotImplementedError, RuntimeError): # RuntimeError is for members marked as encrypted
+        return False
+
+
+def check_zip_structure(zip_path, expected_size=None):
+    # Makes sure every member the central directory lists has a matching local header and fits before the central directory, without decompressing anything
+    try:
+        if expected_size is not None and zip_path.stat().st_size != expected_size:
+            return False
+
+        with zipfile.ZipFile(zip_path) as zipped_file, open(zip_path, "rb") as f:
+            for info in zipped_file.infolist():
+                f.seek(info.header_offset)
+                header = f.read(30)
+
+                if len(header) < 30 or header[:4] != LOCAL_HEADER:
+                    return False
+
+                name_length, extra_length = struct.unpack("<HH", header[26:30])
+
+                if f.read(name_length) != info.orig_filename.encode("utf-8" if info.flag_bits & 0x800 else "cp437"):
+                    return False
+
+                if info.header_offset + 30 + name_length + extra_length + info.compress_size > zipped_file.start_dir:
+                    return False
+    except (zipfile.BadZipFile, OSError, UnicodeEncodeError, struct.error, NotImplementedError):
+        return False
+
+    return True
+
+
+def check_member_crc(zip_path, name):
+    # Each thread opens the zip itself, ZipFile handles can't be shared between threads
+    with zipfile.ZipFile(zip_path) as zipped_file, zipped_file.open(name) as member:
+        while member.read(READ_CHUNK): # Raises BadZipFile at the end if the CRC doesn't match
+            pass
+
+
+def check_zip_crcs(zip_path):
+    if not check_zip_structure(zip_path):
+        return False
+
+    try:
+        with zipfile.ZipFile(zip_path) as zipped_file:
+            names = [info.filename for info in zipped_file.infolist() if not info.is_dir()]
+
+        with ThreadPoolExecutor(max_workers=CRC_WORKERS) as executor:
+            for future in as_completed([executor.submit(check_member_crc, zip_path, name) for name in names]):
+                future.result()
+    except (zipfile.BadZipFile, OSError, zlib.error, EOFError, NotImplementedError, RuntimeError): # RuntimeError is for members marked as encrypted
+        return False
+
+    return True
+
+
+def test_zip(zip_path, level, expected_size=None):
+    # Returns whether the zip is good at the given level ("structural", "crc" or "full")
+    if level == "structural":
+        return check_zip_structure(zip_path, expected_size)
+    elif level == "crc":
+        return check_zip_structure(zip_path, expected_size) and check_zip_crcs(zip_path)
+    elif level == "full":
+        return check_zip_structure(zip_path, expected_size) and test_zip_path(zip_path)
+    else:
+        raise ValueError(f"Unknown verification level {level!r}, should be \"structural\", \"crc\" or \"full\"")
+
+
+def verify_zip_file(zip_path, level="full"):
+    # Returns whether the zip is good and its checksum. Only the "full" level calculates checksums, the others return None for it.
+    if level != "full":
+        return test_zip(zip_path, level), None
+
+    # Reads the zip once, hashing it and checking its members at the same time
+    checksum = hashlib.sha256()
+    verifier = StreamingZipVerifier()
+
+    with open(zip_path, "rb", buffering=0) as f:
+        while chunk := f.read(READ_CHUNK):
+            checksum.update(chunk)
+            verifier.update(chunk)
+
+    zip_result = verify_streamed_zip(zip_path, verifier)
+
+    if zip_result is None:
+        zip_result = test_zip_path(zip_path)
+
+    return zip_result, checksum.hexdigest()
+
+
+def get_file_key(zip_path):
+    # A zip that still has the same size, modification time and inode is assumed unchanged since it was last verified
+    stat = zip_path.stat()
+
+    return [stat.st_size, stat.st_mtime_ns, stat.st_ino]
+
+
+def load_verification_cache(asset_path):
+    try:
+        with open(asset_path / "verification_cache.json", "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def save_verification_cache(verification_cache, asset_path):
+    # Written to a temporary file first so quitting midway never leaves a broken cache behind
+    temp_path = asset_path / "verification_cache.json.tmp"
+
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(verification_cache, f, ensure_ascii=False)
+
+    os.replace(temp_path, asset_path / "verification_cache.json")
+
+
+def is_cached(cached, zip_path, level):
+    # A cached result answers for this level if the zip hasn't changed and it was checked at least this thoroughly, or was found bad at any level
+    if cached is None or cached["key"] != get_file_key(zip_path):
+        return False
+
+    return not cached["good"] or LEVELS.index(cached.get("level", "full")) >= LEVELS.index(level) # Caches from before levels existed were all full checks
+
+
+def verify_zip_files(asset_path, zip_names, workers, level="full"):
+    # Yields (asset, good, checksum) for every zip name as results come in, in no particular order. Cached results are yielded first. checksum is None unless level is "full" (or a full check was cached).
+    if level not in LEVELS:
+        raise ValueError(f"Unknown verification level {level!r}, should be \"structural\", \"crc\" or \"full\"")
+
+    verification_cache = load_verification_cache(asset_path)
+    zips_to_verify = []
+
+    for asset in zip_names:
+        zip_path = asset_path / f"{asset}.zip"
+        cached = verification_cache.get(zip_path.name)
+
+        if is_cached(cached, zip_path, level):
+            yield asset, cached["good"], cached["checksum"]
+        else:
+            zips_to_verify.append(asset)
+
+    last_save = time.monotonic()
+
+    # zlib and hashlib release the GIL, so threads are enough to keep several disks and cores busy
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(verify_zip_file, asset_path / f"{asset}.zip", level): asset for asset in zips_to_verify}
+
+        try:
+            for future in as_completed(futures):
+                asset = futures[future]
+                zip_path = asset_path / f"{asset}.zip"
+
+                try:
+                    good, checksum = future.result()
+                except OSError as ex:
+                    print(f"\nCouldn't read {zip_path}! Exception was {ex}")
+                    yield asset, False, None
+                    continue
+
+                verification_cache[zip_path.name] = {"key": get_file_key(zip_path), "good": good, "checksum": checksum, "level": level}
+
+                if time.monotonic() - last_save > CACHE_SAVE_INTERVAL:
+                    save_verification_cache(verification_cache, asset_path)
+                    last_save = time.monotonic()
+
+                yield asset, good, checksum
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+            save_verification_cache(verification_cache, asset_path)